@@ -0,0 +1,122 @@
+import time
+from typing import Dict, Tuple
+
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+
+from technical_analysis import PerformanceMonitor
+
+# 全局监控器：中间件写入，/metrics 导出
+monitor = PerformanceMonitor()
+
+OPENMETRICS_CONTENT_TYPE = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+UNMATCHED_ROUTE = "__unmatched__"
+STATUS_CLASSES = ("1xx", "2xx", "3xx", "4xx", "5xx")
+HTTP_METHODS = {"GET", "HEAD", "POST", "PUT", "DELETE", "PATCH", "OPTIONS", "TRACE", "CONNECT"}
+
+router = APIRouter(
+    tags=["监控"],
+    dependencies=[]
+)
+
+
+@router.get("/metrics", summary="OpenMetrics 指标导出", response_class=PlainTextResponse)
+async def metrics():
+    return PlainTextResponse(monitor.to_openmetrics(), media_type=OPENMETRICS_CONTENT_TYPE)
+
+
+class _RouteSeries:
+    """一个 (method, route) 标签组合预先生成的指标名"""
+
+    __slots__ = ("operation", "status_counters")
+
+    def __init__(self, monitor: PerformanceMonitor, method: str, route: str):
+        labels = {"method": method, "route": route}
+        self.operation = f"http {method} {route}"
+        monitor.register(self.operation, "http_request_duration_seconds", labels)
+        # 下标为 status // 100，超出范围的状态码归入 5xx
+        self.status_counters = []
+        for status_class in STATUS_CLASSES:
+            metric = f"{self.operation} {status_class}"
+            monitor.register_counter(metric, "http_requests", {**labels, "status": status_class})
+            self.status_counters.append(metric)
+
+
+class MetricsMiddleware:
+    """
+    纯 ASGI 计时中间件（不用 BaseHTTPMiddleware，避免额外的任务与流包装）
+
+    - 按路由模板（如 /api/users/v1/{user_id}）而不是原始路径打标签，标签基数有界；
+      模板在请求时从 scope 中取（与中间件注册时路由是否已挂载无关）
+    - 第一次请求时按 scope["app"] 当前的全部路由预注册 (method, route) 与状态码分类的指标，
+      热路径只有两次取时、字典查找、列表追加与计数器自增，不加锁
+    - 未匹配的路径（404）统一记为 __unmatched__，非标准请求方法记为 OTHER
+    """
+
+    def __init__(self, app, monitor: PerformanceMonitor = monitor):
+        self.app = app
+        self.monitor = monitor
+        self._series: Dict[Tuple[str, str], _RouteSeries] = {}
+        # 非 APIRoute（如 /docs）不会把路由写回 scope，按 endpoint 反查路由模板
+        self._endpoint_paths = {}
+        self._registered = False
+
+    def _register_routes(self, app):
+        """按应用当前的路由登记 endpoint 反查表并预注册指标"""
+        self._registered = True
+        for route in getattr(app, "routes", None) or []:
+            if getattr(route, "endpoint", None) is not None:
+                self._endpoint_paths.setdefault(route.endpoint, route.path)
+            for method in sorted(getattr(route, "methods", None) or ()):
+                self._get_series(method, route.path)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        if not self._registered:
+            self._register_routes(scope.get("app"))
+
+        status_code = 500
+        start = time.perf_counter_ns()
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            end = time.perf_counter_ns()
+            # 路由匹配后 FastAPI 会把匹配到的路由写回同一个 scope
+            route = scope.get("route")
+            if route is not None:
+                path = route.path
+            else:
+                path = self._resolve_endpoint(scope)
+            method = scope["method"]
+            series = self._series.get((method, path)) or self._get_series(method, path)
+            self.monitor.record(series.operation, end - start, end)
+            self.monitor.increment_counter(series.status_counters[min(status_code // 100, 5) - 1])
+
+    def _resolve_endpoint(self, scope) -> str:
+        """非 APIRoute 的路由模板；遇到运行期新增的路由时重新登记一次"""
+        endpoint = scope.get("endpoint")
+        if endpoint is None:
+            return UNMATCHED_ROUTE
+        path = self._endpoint_paths.get(endpoint)
+        if path is None:
+            self._register_routes(scope.get("app"))
+            path = self._endpoint_paths.setdefault(endpoint, UNMATCHED_ROUTE)
+        return path
+
+    def _get_series(self, method: str, path: str) -> _RouteSeries:
+        """注册新的标签组合（只在启动时或遇到运行期新增的路由时发生）"""
+        if method not in HTTP_METHODS:
+            method = "OTHER"
+        series = self._series.get((method, path))
+        if series is None:
+            series = self._series[(method, path)] = _RouteSeries(self.monitor, method, path)
+        return series
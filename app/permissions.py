@@ -0,0 +1,37 @@
+from typing import Callable, Tuple
+
+from fastapi import Depends, HTTPException
+
+from technical_analysis import SecurityValidator
+
+# 全局校验器：权限索引启动时预编译，用户角色走周期过期的缓存
+validator = SecurityValidator()
+
+
+def require_permissions(*permissions: Tuple[str, str], current_user: Callable[..., str]):
+    """
+    生成权限校验依赖项，用户需同时拥有全部 (action, resource) 权限
+
+    用户身份必须来自认证依赖项 current_user（校验令牌 / 会话后返回用户 ID），
+    不能直接取客户端可伪造的请求头。所需权限位图在定义路由时算好，
+    校验在事件循环中执行（不进线程池），每次请求只有一次缓存查找与每个权限一次按位与：
+
+        def current_user(token: str = Header(...)) -> str:
+            return sessions.user_id_for(token)  # 无效令牌抛出 401
+
+        @router.delete("/{item_id}",
+                       dependencies=[Depends(require_permissions(("delete", "system"), current_user=current_user))])
+    """
+    required_masks = validator.permission_masks(permissions)
+
+    async def check(user_id: str = Depends(current_user)) -> str:
+        if not validator.has_permissions(user_id, required_masks):
+            raise HTTPException(status_code=403, detail="权限不足")
+        return user_id
+
+    return check
+
+
+def invalidate_user(user_id: str):
+    """用户角色变更后调用，下一次请求重新解析该用户的权限"""
+    validator.invalidate_permissions(user_id)
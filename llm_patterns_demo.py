@@ -13,6 +13,9 @@ from dataclasses import dataclass
 from enum import Enum
 import logging
 from abc import ABC, abstractmethod
+from contextlib import nullcontext
+
+from technical_analysis import PerformanceMonitor
 
 # 模拟大模型API调用（实际使用时替换为真实的API）
 class MockLLM:
@@ -569,10 +572,13 @@ class LangGraphPattern:
     - 变更管理复杂
     """
     
-    def __init__(self, llm: MockLLM):
+    def __init__(self, llm: MockLLM, monitor: Optional[PerformanceMonitor] = None):
         self.llm = llm
         self.nodes: Dict[str, GraphNode] = {}
         self.execution_order = []
+        # 传入监控器时，每次执行记录 langgraph.execute，每个节点记录 langgraph.node.<节点名>；
+        # 默认不计时（如服务中可传入 app.metrics.monitor，由 /metrics 导出）
+        self.monitor = monitor
     
     def add_node(self, name: str, handler, dependencies: List[str] = None):
         """添加节点到图中"""
@@ -609,6 +615,15 @@ class LangGraphPattern:
     
     async def execute(self, initial_data: Dict[str, Any]) -> Dict[str, Any]:
         """执行图工作流"""
+        with self._span("langgraph.execute"):
+            return await self._execute(initial_data)
+    
+    def _span(self, operation: str):
+        """未配置监控器时返回空上下文"""
+        return self.monitor.span(operation) if self.monitor is not None else nullcontext()
+    
+    async def _execute(self, initial_data: Dict[str, Any]) -> Dict[str, Any]:
+        """按拓扑顺序执行各节点"""
         try:
             execution_order = self._topological_sort()
             self.execution_order = execution_order
@@ -626,10 +641,11 @@ class LangGraphPattern:
                 
                 # 执行节点
                 try:
-                    if asyncio.iscoroutinefunction(node.handler):
-                        result = await node.handler(context, self.llm)
-                    else:
-                        result = node.handler(context, self.llm)
+                    with self._span(f"langgraph.node.{node_name}"):
+                        if asyncio.iscoroutinefunction(node.handler):
+                            result = await node.handler(context, self.llm)
+                        else:
+                            result = node.handler(context, self.llm)
                     
                     node.result = result
                     node.completed = True
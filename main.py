@@ -5,7 +5,7 @@ import httpx
 from typing import Union
 from fastapi import FastAPI, HTTPException,Header,Request,Depends
 from fastapi.responses import JSONResponse
-from app import users,products
+from app import users,products,metrics
 import uvicorn
 from fastapi.responses import StreamingResponse
 def verify_token(token: str = Header(...)):
@@ -15,8 +15,11 @@ def verify_token(token: str = Header(...)):
 
 #app = FastAPI(dependencies=[Depends(verify_token)])
 app = FastAPI()
+#计时中间件：第一次请求时按全部路由预注册指标，/metrics 导出 OpenMetrics 文本
+app.add_middleware(metrics.MetricsMiddleware, monitor=metrics.monitor)
 app.include_router(users.router)
 app.include_router(products.router)
+app.include_router(metrics.router)
 
 
 #定义一个依赖项
@@ -0,0 +1,1389 @@
+#!/usr/bin/env python3
+"""
+大模型开发技术组件性能基准测试
+Performance Benchmarks for technical_analysis.py
+
+包含：
+1. ModelCache 吞吐量基准
+2. 语义缓存近邻查找延迟
+3. ModelCache 并发 single-flight 压测（线程 / asyncio）
+4. BatchProcessor 固定 vs 自适应批次负载测试
+5. BatchProcessor 优先级通道：批量任务洪峰下交互请求的 p95
+6. BatchProcessor 进程池模式的多核扩展性
+7. LoadBalancer 各策略在 1000 个后端下的选择吞吐，及异构延迟下的尾延迟
+8. LoadBalancer 一致性哈希 vs 轮询：后端本地缓存命中率、负载倾斜、增删节点的 key 迁移比例
+9. PerformanceMonitor 流式直方图：记录吞吐、内存占用与分位数误差
+10. Span 热路径开销（每个 Span 的纳秒数，目标 < 1 µs）
+11. FastAPI 计时中间件的每请求开销
+12. SecurityValidator 组合扫描器 vs 逐条正则（1 KB / 100 KB / 10 MB）
+13. Aho-Corasick 关键词引擎：规则数增长时的扫描耗时，及热更新期间的校验延迟
+14. StreamingSanitizer 逐 token 输出时的清理吞吐与最大保留字符数
+15. RBAC 权限检查：10 万用户 × 1000 个资源，逐条扫描 vs 预编译位图索引
+16. HallucinationDetector 矛盾检测：逐对比较 vs 否定词倒排表（10 ~ 10000 句）
+17. 外部事实验证：逐条请求 vs 批量异步验证（并发上限 + 结果缓存）
+18. ContextWindow 10 万段对话历史：整体排序压缩 vs 优先级堆 + 时间顺序双索引，tokenizer 缓存命中
+19. ContextWindow 渲染：每次整体拼接 vs 分块缓存的增量渲染
+20. 长期记忆倒排索引：BM25 查询延迟（1 万 ~ 100 万条）
+21. 长期记忆向量层：IVF 近似检索 vs 全量矩阵乘法的召回率与 QPS（内存 / memmap）
+22. 长期记忆渐进式遗忘：长时间写入下有无容量上限的条目数、索引内存与进程 RSS
+
+使用：python technical_benchmarks.py
+"""
+
+import asyncio
+import math
+import os
+import random
+import re
+import tempfile
+import threading
+import time
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Any
+
+import numpy as np
+
+from technical_analysis import (
+    ModelCache, HashingEmbedder, BatchProcessor, AdaptiveBatchController, QueueFullError,
+    LoadBalancer, PerformanceMonitor, SecurityValidator, AhoCorasickAutomaton, StreamingSanitizer,
+    HallucinationDetector, StubFactVerifier, BatchFactChecker, ContextWindow, InvertedIndex,
+    VectorMemoryStore, HierarchicalContextManager
+)
+
+
+def _ops_per_second(count: int, seconds: float) -> float:
+    """计算每秒操作数"""
+    return count / seconds if seconds > 0 else float("inf")
+
+
+def print_table(title: str, rows: List[Dict[str, Any]]):
+    """打印结果表格"""
+    print(f"\n{title}")
+    print("-" * 60)
+    if not rows:
+        return
+    headers = list(rows[0].keys())
+    print("  ".join(f"{h:>14}" for h in headers))
+    for row in rows:
+        cells = []
+        for h in headers:
+            value = row[h]
+            if isinstance(value, float):
+                cells.append(f"{value:>14,.1f}" if abs(value) >= 100 else f"{value:>14.3f}")
+            else:
+                cells.append(f"{value!s:>14}")
+        print("  ".join(cells))
+
+
+# ==================== 1. 缓存基准 ====================
+def benchmark_model_cache(sizes: List[int] = None) -> List[Dict[str, Any]]:
+    """ModelCache set/get 吞吐量（缓存已满时每次 set 都会触发淘汰）"""
+    sizes = sizes or [1_000, 100_000, 1_000_000]
+    rows = []
+
+    for size in sizes:
+        cache = ModelCache(max_size=size)
+        keys = [f"prompt-{i}" for i in range(size * 2)]
+
+        # 先填满，再写入同样数量的新键，后一半全部走淘汰路径
+        start = time.perf_counter()
+        for key in keys:
+            cache.set(key, key)
+        set_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for key in keys[size:]:
+            cache.get(key)
+        get_seconds = time.perf_counter() - start
+
+        rows.append({
+            "entries": size,
+            "set_ops/s": _ops_per_second(len(keys), set_seconds),
+            "get_ops/s": _ops_per_second(size, get_seconds),
+            "hit_rate": cache.get_stats()["hit_rate"]
+        })
+
+    print_table("ModelCache 吞吐量", rows)
+    return rows
+
+
+def benchmark_semantic_cache(size: int = 100_000, queries: int = 1_000) -> Dict[str, Any]:
+    """语义缓存在 size 个条目下的查找延迟（查询为已缓存提示的改写）"""
+    rng = random.Random(0)
+    vocabulary = [f"word{i}" for i in range(5_000)]
+    prompts = [" ".join(rng.choices(vocabulary, k=12)) for _ in range(size)]
+
+    cache = ModelCache(max_size=size, semantic_threshold=0.8)
+    start = time.perf_counter()
+    for i, prompt in enumerate(prompts):
+        cache.set(prompt, i)
+    build_seconds = time.perf_counter() - start
+
+    # 改写：标点、大小写、空白变化并替换一个词
+    rewrites = []
+    for prompt in rng.sample(prompts, queries):
+        words = prompt.split()
+        words[rng.randrange(len(words))] = rng.choice(vocabulary)
+        rewrites.append("  " + ", ".join(words).upper() + "?")
+
+    embedder = HashingEmbedder()
+    vectors = [embedder(cache._normalize_prompt(q)) for q in rewrites]
+    start = time.perf_counter()
+    for vector in vectors:
+        cache.semantic_index.search(vector, k=1)
+    search_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for query in rewrites:
+        cache.get(query)
+    get_seconds = time.perf_counter() - start
+
+    stats = cache.get_stats()
+    result = {
+        "entries": size,
+        "build_s": build_seconds,
+        "index_search_ms": search_seconds / queries * 1e3,
+        "get_ms": get_seconds / queries * 1e3,
+        "semantic_hit_rate": stats["semantic_hits"] / queries
+    }
+    print_table("语义缓存查找延迟", [result])
+    return result
+
+
+def benchmark_single_flight_threads(callers: int = 1_000, keys: int = 10) -> Dict[str, Any]:
+    """1000 个线程同时请求 keys 个键，统计每个键的后端调用次数（期望均为 1）"""
+    cache = ModelCache(max_size=keys)
+    backend_calls = Counter()
+    calls_lock = threading.Lock()
+    barrier = threading.Barrier(callers)
+
+    def backend(key: str) -> str:
+        with calls_lock:
+            backend_calls[key] += 1
+        time.sleep(0.05)  # 模拟 LLM 调用
+        return f"answer:{key}"
+
+    def caller(i: int) -> str:
+        key = f"prompt-{i % keys}"
+        barrier.wait()
+        return cache.get_or_compute(key, lambda: backend(key))
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=callers) as pool:
+        answers = list(pool.map(caller, range(callers)))
+    elapsed = time.perf_counter() - start
+
+    result = {
+        "callers": callers,
+        "keys": keys,
+        "backend_calls": sum(backend_calls.values()),
+        "max_calls_per_key": max(backend_calls.values()),
+        "correct_answers": sum(a == f"answer:prompt-{i % keys}" for i, a in enumerate(answers)),
+        "elapsed_s": elapsed
+    }
+    print_table("single-flight 压测（线程）", [result])
+    return result
+
+
+async def benchmark_single_flight_async(callers: int = 1_000, keys: int = 10) -> Dict[str, Any]:
+    """1000 个协程同时请求 keys 个键，统计每个键的后端调用次数（期望均为 1）"""
+    cache = ModelCache(max_size=keys)
+    backend_calls = Counter()
+
+    async def backend(key: str) -> str:
+        backend_calls[key] += 1
+        await asyncio.sleep(0.05)  # 模拟 LLM 调用
+        return f"answer:{key}"
+
+    async def caller(i: int) -> str:
+        key = f"prompt-{i % keys}"
+        return await cache.aget_or_compute(key, lambda: backend(key))
+
+    start = time.perf_counter()
+    answers = await asyncio.gather(*(caller(i) for i in range(callers)))
+    elapsed = time.perf_counter() - start
+
+    result = {
+        "callers": callers,
+        "keys": keys,
+        "backend_calls": sum(backend_calls.values()),
+        "max_calls_per_key": max(backend_calls.values()),
+        "correct_answers": sum(a == f"answer:prompt-{i % keys}" for i, a in enumerate(answers)),
+        "elapsed_s": elapsed
+    }
+    print_table("single-flight 压测（asyncio）", [result])
+    return result
+
+
+# ==================== 2. 批处理基准 ====================
+async def simulated_backend(requests: List[Dict[str, Any]]) -> List[Any]:
+    """模拟后端：固定开销 20ms + 每个请求 1ms"""
+    await asyncio.sleep(0.02 + 0.001 * len(requests))
+    return [request["id"] for request in requests]
+
+
+async def _generate_load(processor: BatchProcessor, rate: float, duration: float,
+                         warmup: float = 0.5, seed: int = 0) -> Dict[str, Any]:
+    """
+    开环泊松到达的负载生成器，返回吞吐量与延迟分位数
+
+    到达时间预先按指数分布生成，每毫秒把已到期的请求一次性发出，
+    避免 asyncio.sleep 的精度限制压低实际到达率；预热期内的请求不计入延迟统计。
+    """
+    rng = random.Random(seed)
+    latencies: List[float] = []
+    failures = 0
+
+    async def one_request(i: int, measured: bool):
+        nonlocal failures
+        start = time.perf_counter()
+        try:
+            await processor.add_request({"id": i})
+            if measured:
+                latencies.append(time.perf_counter() - start)
+        except QueueFullError:
+            failures += 1
+
+    tasks = []
+    start = time.perf_counter()
+    next_arrival = 0.0
+    i = 0
+    while True:
+        elapsed = time.perf_counter() - start
+        if elapsed >= warmup + duration:
+            break
+        while next_arrival <= elapsed:
+            tasks.append(asyncio.create_task(one_request(i, next_arrival >= warmup)))
+            i += 1
+            next_arrival += rng.expovariate(rate)
+        await asyncio.sleep(0.001)
+    await asyncio.gather(*tasks)
+    await processor.close()
+
+    percentile = AdaptiveBatchController.percentile
+    return {
+        "completed/s": len(latencies) / duration,
+        "p50_ms": percentile(latencies, 0.50) * 1e3,
+        "p99_ms": percentile(latencies, 0.99) * 1e3,
+        "failed": failures,
+        "final_batch": processor.current_batch_size
+    }
+
+
+async def benchmark_adaptive_batching(rate: float = 1_500, duration: float = 3.0,
+                                      latency_target: float = 0.08) -> List[Dict[str, Any]]:
+    """对比固定配置与自适应控制器在同一负载下的吞吐与尾延迟"""
+    rows = []
+    configs = [
+        ("fixed 64/200ms", dict(batch_size=64, timeout=0.2)),
+        ("fixed 4/5ms", dict(batch_size=4, timeout=0.005)),
+        ("adaptive", dict(batch_size=64, timeout=0.2, latency_target=latency_target)),
+    ]
+    for name, kwargs in configs:
+        processor = BatchProcessor(batch_handler=simulated_backend, max_queue_size=2_000,
+                                   overflow_policy="shed_oldest", **kwargs)
+        result = await _generate_load(processor, rate, duration)
+        rows.append({"mode": name, **result})
+
+    print_table(f"批处理负载测试（{rate:.0f} req/s，p99 目标 {latency_target * 1e3:.0f}ms）", rows)
+    return rows
+
+
+async def benchmark_priority_lanes(interactive_rate: float = 100, bulk_rate: float = 4_000,
+                                   phase: float = 2.0) -> List[Dict[str, Any]]:
+    """
+    交互请求先单独运行 phase 秒，再叠加 phase 秒的批量任务洪峰，
+    对比单一 FIFO 通道与 interactive/bulk 双通道下交互请求的 p95 延迟，
+    以及预留给交互通道的后端槽位数（共 4 个）对批量任务完成数的影响
+    """
+    percentile = AdaptiveBatchController.percentile
+    rows = []
+
+    modes = [("single lane", None), ("priority lanes, 1 reserved", 1), ("priority lanes, 2 reserved", 2)]
+    for mode, reserved_slots in modes:
+        lanes = {"interactive": 0.5, "bulk": None} if reserved_slots else None
+        processor = BatchProcessor(batch_size=32, timeout=0.005, batch_handler=simulated_backend,
+                                   lanes=lanes, reserved_slots=reserved_slots)
+        interactive_lane = "interactive" if lanes else "default"
+        bulk_lane = "bulk" if lanes else "default"
+        latencies = {"quiet": [], "flood": []}
+        expired = 0
+
+        async def interactive_request(i: int, phase_name: str):
+            nonlocal expired
+            start = time.perf_counter()
+            try:
+                await processor.add_request({"id": i}, priority=interactive_lane)
+                latencies[phase_name].append(time.perf_counter() - start)
+            except Exception:
+                expired += 1
+
+        interactive_tasks, bulk_tasks = [], []
+        interactive_rng, bulk_rng = random.Random(0), random.Random(1)
+        start = time.perf_counter()
+        next_interactive, next_bulk = 0.0, phase
+        i = 0
+        while True:
+            elapsed = time.perf_counter() - start
+            if elapsed >= 2 * phase:
+                break
+            while next_interactive <= elapsed:
+                phase_name = "quiet" if next_interactive < phase else "flood"
+                interactive_tasks.append(asyncio.create_task(interactive_request(i, phase_name)))
+                next_interactive += interactive_rng.expovariate(interactive_rate)
+                i += 1
+            while next_bulk <= elapsed:
+                bulk_tasks.append(asyncio.create_task(processor.add_request({"id": i}, priority=bulk_lane)))
+                next_bulk += bulk_rng.expovariate(bulk_rate)
+                i += 1
+            await asyncio.sleep(0.001)
+
+        # 洪峰结束时已完成的批量任务数；之后只等待交互请求，积压的批量任务直接取消
+        bulk_done = sum(1 for task in bulk_tasks if task.done() and not task.exception())
+        await asyncio.gather(*interactive_tasks)
+        for task in bulk_tasks:
+            task.cancel()
+        await asyncio.gather(*bulk_tasks, return_exceptions=True)
+        await processor.close()
+
+        rows.append({
+            "mode": mode,
+            "quiet_p95_ms": percentile(latencies["quiet"], 0.95) * 1e3,
+            "flood_p95_ms": percentile(latencies["flood"], 0.95) * 1e3,
+            "interactive_ok": len(latencies["quiet"]) + len(latencies["flood"]),
+            "interactive_failed": expired,
+            "bulk_done": bulk_done
+        })
+
+    print_table(f"优先级通道（交互 {interactive_rate:.0f} req/s，洪峰 {bulk_rate:.0f} req/s）", rows)
+    return rows
+
+
+_VALIDATION_PATTERN = re.compile(r'(\w+)@(\w+)\.com|\b\d{3}-\d{4}\b')
+
+
+def cpu_bound_handler(requests: List[Dict[str, Any]]) -> List[Any]:
+    """模拟 CPU 密集的批处理：分词 + 正则校验 + 本地打分（需为模块级函数以便进程池 pickle）"""
+    results = []
+    for request in requests:
+        text = request["text"]
+        score = 0
+        for _ in range(request.get("rounds", 20)):
+            tokens = text.lower().split()
+            score += sum(len(token) for token in tokens) + len(_VALIDATION_PATTERN.findall(text))
+        results.append(score)
+    return results
+
+
+async def benchmark_process_pool(requests_count: int = 2_000, batch_size: int = 64) -> List[Dict[str, Any]]:
+    """同一 CPU 密集负载在事件循环内执行与进程池（不同 worker 数）执行的吞吐对比"""
+    text = "user42@example.com 请校验 555-1234 这段 text " * 20
+    requests = [{"text": text, "rounds": 20} for _ in range(requests_count)]
+
+    async def inline_handler(batch: List[Dict[str, Any]]) -> List[Any]:
+        return cpu_bound_handler(batch)
+
+    cpu_count = os.cpu_count() or 1
+    configs = [("event loop", dict(batch_handler=inline_handler))]
+    for workers in sorted({1, 2, 4, cpu_count}):
+        configs.append((f"process x{workers}", dict(batch_handler=cpu_bound_handler,
+                                                   execution_mode="process", max_workers=workers)))
+
+    rows = []
+    for name, kwargs in configs:
+        async with BatchProcessor(batch_size=batch_size, timeout=0.01, **kwargs) as processor:
+            # 预热进程池
+            await processor.add_request(requests[0])
+            start = time.perf_counter()
+            await asyncio.gather(*(processor.add_request(request) for request in requests))
+            elapsed = time.perf_counter() - start
+        rows.append({"mode": name, "req/s": requests_count / elapsed, "elapsed_s": elapsed})
+
+    print_table(f"进程池扩展性（{cpu_count} 核）", rows)
+    return rows
+
+
+# ==================== 3. 负载均衡基准 ====================
+LB_STRATEGIES = ["round_robin", "least_connections", "weighted", "p2c", "peak_ewma", "consistent_hash"]
+
+
+def benchmark_load_balancer(sizes: List[int] = None, iterations: int = 100_000) -> List[Dict[str, Any]]:
+    """不同后端数量下 select + acquire + release 的吞吐"""
+    sizes = sizes or [10, 100, 1_000]
+    rows = []
+    for size in sizes:
+        balancer = LoadBalancer()
+        for i in range(size):
+            balancer.add_backend(f"backend-{i}", weight=1 + i % 5)
+        row = {"backends": size}
+        for strategy in LB_STRATEGIES:
+            start = time.perf_counter()
+            for _ in range(iterations):
+                backend_id = balancer.select_backend(strategy, key=f"prompt-{_ & 1023}")
+                balancer.acquire(backend_id)
+                balancer.release(backend_id, 0.01)
+            row[strategy] = _ops_per_second(iterations, time.perf_counter() - start)
+        rows.append(row)
+
+    print_table("LoadBalancer 选择吞吐（ops/s）", rows)
+    return rows
+
+
+async def benchmark_load_balancer_latency(backends: int = 20, requests_count: int = 4_000,
+                                          concurrency: int = 40) -> List[Dict[str, Any]]:
+    """异构后端（少数慢节点 + 一个持续失败节点）下各策略的平均 / p99 延迟"""
+    rng = random.Random(7)
+    base_latency = {f"backend-{i}": (0.05 if i < 3 else 0.005) for i in range(backends)}
+    failing = f"backend-{backends - 1}"
+
+    rows = []
+    for strategy in ["round_robin", "least_connections", "p2c", "peak_ewma"]:
+        balancer = LoadBalancer(max_failures=3, eject_duration=60)
+        for backend_id in base_latency:
+            balancer.add_backend(backend_id)
+        latencies = []
+        failures = 0
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def one_request():
+            nonlocal failures
+            async with semaphore:
+                start = time.perf_counter()
+                try:
+                    with balancer.connection(strategy) as backend_id:
+                        await asyncio.sleep(base_latency[backend_id] * rng.uniform(0.5, 1.5))
+                        if backend_id == failing:
+                            raise ConnectionError(backend_id)
+                except ConnectionError:
+                    failures += 1
+                latencies.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(one_request() for _ in range(requests_count)))
+        elapsed = time.perf_counter() - start
+        rows.append({
+            "strategy": strategy,
+            "req/s": requests_count / elapsed,
+            "mean_ms": sum(latencies) / len(latencies) * 1000,
+            "p99_ms": AdaptiveBatchController.percentile(latencies, 0.99) * 1000,
+            "failures": failures,
+            "ejected": balancer.get_stats()["ejected"],
+        })
+
+    print_table(f"LoadBalancer 异构延迟（{backends} 个后端，3 个慢节点，1 个故障节点）", rows)
+    return rows
+
+
+def _zipf_keys(count: int, universe: int, rng: random.Random, s: float = 1.0) -> List[str]:
+    """按 Zipf 分布生成提示键（少数热门提示占大部分流量）"""
+    weights = [1 / (rank ** s) for rank in range(1, universe + 1)]
+    return [f"prompt-{i}" for i in rng.choices(range(universe), weights=weights, k=count)]
+
+
+def simulate_cache_affinity(backends: int = 10, requests_count: int = 100_000, universe: int = 20_000,
+                            cache_size: int = 1_000, inflight: int = 64) -> List[Dict[str, Any]]:
+    """
+    每个后端持有本地 ModelCache，比较不同路由策略下的整体命中率与负载倾斜；
+    保持 inflight 个请求处于进行中，使有界负载生效
+    """
+    keys = _zipf_keys(requests_count, universe, random.Random(11))
+    configs = [
+        ("round_robin", "round_robin", None),
+        ("consistent_hash", "consistent_hash", None),
+        ("consistent_hash bounded 1.25", "consistent_hash", 1.25),
+    ]
+
+    rows = []
+    for name, strategy, load_factor in configs:
+        balancer = LoadBalancer(load_factor=load_factor)
+        caches = {}
+        for i in range(backends):
+            balancer.add_backend(f"backend-{i}")
+            caches[f"backend-{i}"] = ModelCache(max_size=cache_size)
+        served = Counter()
+        peak_connections = Counter()
+        window = deque()
+
+        for key in keys:
+            backend_id = balancer.select_backend(strategy, key=key)
+            balancer.acquire(backend_id)
+            peak_connections[backend_id] = max(peak_connections[backend_id],
+                                               balancer.current_loads[backend_id])
+            window.append(backend_id)
+            if len(window) > inflight:
+                balancer.release(window.popleft())
+
+            served[backend_id] += 1
+            cache = caches[backend_id]
+            if cache.get(key) is None:
+                cache.set(key, key)
+
+        hits = sum(cache.get_stats()["hit_count"] for cache in caches.values())
+        mean_load = requests_count / backends
+        rows.append({
+            "strategy": name,
+            "hit_rate": hits / requests_count,
+            "max/mean_load": max(served.values()) / mean_load,
+            "peak_conns": max(peak_connections.values()),
+        })
+
+    print_table(f"缓存亲和性模拟（{backends} 个后端，Zipf {universe} 个提示，每后端缓存 {cache_size}）", rows)
+    return rows
+
+
+def benchmark_key_movement(backends: int = 10, keys_count: int = 10_000) -> Dict[str, Any]:
+    """增删一个后端时改变归属的 key 比例（理想值约 1/n）"""
+    keys = [f"session-{i}" for i in range(keys_count)]
+    balancer = LoadBalancer(load_factor=None)
+    for i in range(backends):
+        balancer.add_backend(f"backend-{i}")
+
+    def assignment():
+        return [balancer.select_backend("consistent_hash", key=key) for key in keys]
+
+    before = assignment()
+    balancer.add_backend(f"backend-{backends}")
+    after_add = assignment()
+    balancer.remove_backend("backend-0")
+    after_remove = assignment()
+
+    result = {
+        "add_moved": sum(a != b for a, b in zip(before, after_add)) / keys_count,
+        "remove_moved": sum(a != b for a, b in zip(after_add, after_remove)) / keys_count,
+        "ideal_add": 1 / (backends + 1),
+        "ideal_remove": 1 / (backends + 1),
+    }
+    print_table(f"一致性哈希 key 迁移比例（{backends} -> {backends + 1} -> {backends} 个后端）", [result])
+    return result
+
+
+# ==================== 4. 可观测性基准 ====================
+def benchmark_performance_monitor(records: int = 1_000_000) -> Dict[str, Any]:
+    """PerformanceMonitor 记录吞吐、直方图桶数与分位数相对误差（对比精确排序）"""
+    rng = random.Random(5)
+    durations = [int(rng.lognormvariate(15, 1.2)) for _ in range(records)]
+    monitor = PerformanceMonitor()
+
+    start = time.perf_counter()
+    for duration in durations:
+        monitor.record("llm_call", duration)
+    elapsed = time.perf_counter() - start
+
+    stats = monitor.get_stats()["llm_call"]
+    ordered = sorted(durations)
+    rows = []
+    for name, q in PerformanceMonitor.PERCENTILES.items():
+        exact = ordered[max(1, math.ceil(q * records)) - 1] / 1e9
+        rows.append({"percentile": name, "exact_ms": exact * 1000, "estimate_ms": stats[name] * 1000,
+                     "rel_error": abs(stats[name] - exact) / exact})
+    print_table(f"PerformanceMonitor 分位数精度（{records:,} 条记录）", rows)
+
+    result = {
+        "records": records,
+        "record_ops/s": _ops_per_second(records, elapsed),
+        "buckets": len(monitor.metrics["llm_call"].counts),
+        "window_1m_count": stats["windows"]["1m"]["count"],
+    }
+    print_table("PerformanceMonitor 记录吞吐与内存", [result])
+    return result
+
+
+async def benchmark_span_overhead(iterations: int = 500_000) -> List[Dict[str, Any]]:
+    """每个 Span 的额外开销：带 Span 的空循环减去空循环（含批量聚合的摊销成本）"""
+    monitor = PerformanceMonitor()
+
+    def empty_loop():
+        for _ in range(iterations):
+            pass
+
+    def span_loop():
+        span = monitor.span
+        for _ in range(iterations):
+            with span("hot_path"):
+                pass
+
+    async def async_span_loop():
+        span = monitor.span
+        for _ in range(iterations):
+            async with span("hot_path_async"):
+                pass
+
+    @monitor.span("decorated")
+    def decorated():
+        pass
+
+    def decorated_loop():
+        for _ in range(iterations):
+            decorated()
+
+    def clock_loop():
+        clock = time.perf_counter_ns
+        for _ in range(iterations):
+            clock()
+            clock()
+
+    def plain_call_loop():
+        def plain():
+            pass
+        for _ in range(iterations):
+            plain()
+
+    def timed(func) -> float:
+        start = time.perf_counter_ns()
+        func()
+        return (time.perf_counter_ns() - start) / iterations
+
+    async def timed_async(func) -> float:
+        start = time.perf_counter_ns()
+        await func()
+        return (time.perf_counter_ns() - start) / iterations
+
+    baseline = min(timed(empty_loop) for _ in range(3))
+    call_baseline = min(timed(plain_call_loop) for _ in range(3))
+    rows = [
+        {"mode": "2x perf_counter_ns（下限参考）", "ns/span": min(timed(clock_loop) for _ in range(3)) - baseline},
+        {"mode": "with", "ns/span": min(timed(span_loop) for _ in range(3)) - baseline},
+        {"mode": "async with", "ns/span": min([await timed_async(async_span_loop) for _ in range(3)]) - baseline},
+        {"mode": "decorator", "ns/span": min(timed(decorated_loop) for _ in range(3)) - call_baseline},
+    ]
+    monitor.get_stats()
+    print_table("Span 开销（已扣除空循环 / 普通函数调用）", rows)
+    return rows
+
+
+async def benchmark_metrics_middleware(requests_count: int = 20_000) -> List[Dict[str, Any]]:
+    """直接调用 ASGI 应用（不经网络），对比有无 MetricsMiddleware 的每请求耗时"""
+    from fastapi import FastAPI
+    from app import products
+    from app.metrics import MetricsMiddleware
+
+    def build(with_middleware: bool):
+        app = FastAPI()
+        if with_middleware:
+            app.add_middleware(MetricsMiddleware, monitor=PerformanceMonitor())
+        app.include_router(products.router)
+        return app
+
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET",
+        "scheme": "http", "path": "/api/product/v1/42", "raw_path": b"/api/product/v1/42",
+        "query_string": b"", "root_path": "", "headers": [], "server": ("test", 80), "client": ("test", 1),
+    }
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        pass
+
+    async def run(app) -> float:
+        await app(dict(scope), receive, send)  # 构建中间件栈
+        start = time.perf_counter_ns()
+        for _ in range(requests_count):
+            await app(dict(scope), receive, send)
+        return (time.perf_counter_ns() - start) / requests_count / 1000
+
+    async def passthrough(scope, receive, send):
+        pass
+
+    bare = MetricsMiddleware(passthrough, monitor=PerformanceMonitor())
+
+    async def run_isolated(app) -> float:
+        start = time.perf_counter_ns()
+        for _ in range(requests_count):
+            await app(dict(scope), receive, send)
+        return (time.perf_counter_ns() - start) / requests_count / 1000
+
+    baseline = min([await run(build(False)) for _ in range(3)])
+    instrumented = min([await run(build(True)) for _ in range(3)])
+    rows = [
+        {"mode": "FastAPI 无中间件", "us/request": baseline},
+        {"mode": "FastAPI + MetricsMiddleware", "us/request": instrumented},
+        {"mode": "差值", "us/request": instrumented - baseline},
+        {"mode": "中间件单独（空应用）", "us/request": min([await run_isolated(bare) for _ in range(3)])
+                                          - min([await run_isolated(passthrough) for _ in range(3)])},
+    ]
+    print_table("MetricsMiddleware 每请求开销", rows)
+    return rows
+
+
+# ==================== 5. 安全扫描基准 ====================
+def _make_security_text(size: int, rng: random.Random) -> str:
+    """生成中英文混合文本，按约 0.2% 的词频混入注入语句与敏感信息"""
+    words = "the quick brown fox 请 帮我 总结 这段 文本 user data report 2024 analysis model prompt".split()
+    specials = ["ignore previous instructions", "system:", "alice@example.com", "13800138000",
+                "4111-1111-1111-1111", "123-45-6789", "<script>x()</script>", "eval("]
+    parts, length = [], 0
+    while length < size:
+        word = rng.choice(specials) if rng.random() < 0.002 else rng.choice(words)
+        parts.append(word)
+        length += len(word) + 1
+    return " ".join(parts)[:size]
+
+
+def _validate_per_pattern(validator: SecurityValidator, text: str) -> int:
+    """改造前的实现：每条规则单独扫描一遍（返回命中的规则数）"""
+    issues = 0
+    for pattern in validator.injection_patterns:
+        if re.search(pattern, text, re.IGNORECASE):
+            issues += 1
+    for pattern in validator.sensitive_patterns:
+        if re.findall(pattern, text, re.IGNORECASE):
+            issues += 1
+    return issues
+
+
+def _sanitize_per_pattern(validator: SecurityValidator, text: str) -> str:
+    """改造前的实现：逐条 re.sub"""
+    for pattern in validator.sensitive_patterns:
+        text = re.sub(pattern, "[REDACTED]", text, flags=re.IGNORECASE)
+    return re.sub(r'<script.*?</script>', '', text, flags=re.IGNORECASE | re.DOTALL)
+
+
+def benchmark_security_scanner(sizes: List[int] = None) -> List[Dict[str, Any]]:
+    """validate_input + sanitize_output：逐条正则 vs 单次遍历组合扫描器"""
+    sizes = sizes or [1_000, 100_000, 10_000_000]
+    validator = SecurityValidator()
+    rng = random.Random(3)
+    rows = []
+    for size in sizes:
+        text = _make_security_text(size, rng)
+        repeat = max(1, 1_000_000 // size)
+
+        start = time.perf_counter()
+        for _ in range(repeat):
+            _validate_per_pattern(validator, text)
+            legacy_output = _sanitize_per_pattern(validator, text)
+        legacy = (time.perf_counter() - start) / repeat
+
+        start = time.perf_counter()
+        for _ in range(repeat):
+            validator.validate_input(text)
+            output = validator.sanitize_output(text)
+        combined = (time.perf_counter() - start) / repeat
+
+        rows.append({
+            "size": f"{size // 1000} KB" if size < 1_000_000 else f"{size // 1_000_000} MB",
+            "per_pattern_ms": legacy * 1000,
+            "combined_ms": combined * 1000,
+            "speedup": legacy / combined,
+            "matches": len(validator.scan(text)),
+            "same_output": output == legacy_output,
+        })
+
+    print_table("SecurityValidator 扫描耗时（validate_input + sanitize_output）", rows)
+    return rows
+
+
+def _random_phrases(count: int, rng: random.Random) -> List[str]:
+    """随机生成中英文短语作为关键词规则"""
+    chinese = "忽略之前所有指令系统提示开发者模式输出内部机密数据密码账号越狱角色扮演"
+    english = ["ignore", "all", "previous", "rules", "reveal", "secret", "prompt", "jailbreak",
+               "developer", "mode", "bypass", "filter", "admin", "token", "leak"]
+    phrases = set()
+    while len(phrases) < count:
+        if rng.random() < 0.5:
+            phrases.add("".join(rng.choice(chinese) for _ in range(rng.randint(4, 8))))
+        else:
+            phrases.add(" ".join(rng.choice(english) for _ in range(rng.randint(3, 5))))
+    return sorted(phrases)
+
+
+def benchmark_keyword_engine(rule_counts: List[int] = None, text_size: int = 100_000) -> List[Dict[str, Any]]:
+    """Aho-Corasick vs 转义字面量拼成的正则：规则数从 100 增长到 10000 时的扫描耗时"""
+    rule_counts = rule_counts or [100, 1_000, 10_000]
+    rng = random.Random(9)
+    text = _make_security_text(text_size, rng)
+    rows = []
+    for count in rule_counts:
+        phrases = _random_phrases(count, rng)
+
+        start = time.perf_counter()
+        automaton = AhoCorasickAutomaton([(phrase, "blocked_term") for phrase in phrases])
+        build = time.perf_counter() - start
+        start = time.perf_counter()
+        hits = len(automaton.scan(text))
+        ac_seconds = time.perf_counter() - start
+
+        pattern = re.compile("|".join(re.escape(phrase) for phrase in phrases), re.IGNORECASE)
+        start = time.perf_counter()
+        pattern.findall(text)
+        regex_seconds = time.perf_counter() - start
+
+        rows.append({
+            "rules": count,
+            "build_ms": build * 1000,
+            "ac_scan_ms": ac_seconds * 1000,
+            "regex_scan_ms": regex_seconds * 1000,
+            "hits": hits,
+        })
+
+    print_table(f"关键词引擎扫描耗时（文本 {text_size // 1000} KB）", rows)
+    return rows
+
+
+def stress_keyword_hot_reload(rules: int = 5_000, duration: float = 2.0, workers: int = 4) -> List[Dict[str, Any]]:
+    """多线程持续校验的同时反复热更新规则文件，统计校验延迟与错误数"""
+    rng = random.Random(13)
+    rule_sets = [_random_phrases(rules, rng) for _ in range(2)]
+    text = _make_security_text(2_000, rng)
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "keywords.txt")
+
+        def write_rules(phrases: List[str]):
+            with open(path, "w", encoding="utf-8") as f:
+                f.write("\n".join(f"blocked_term\t{phrase}" for phrase in phrases))
+
+        write_rules(rule_sets[0])
+        validator = SecurityValidator(keyword_rules_path=path)
+        latencies: List[float] = []
+        errors: List[Exception] = []
+
+        def validate_loop(stop: threading.Event):
+            while not stop.is_set():
+                start = time.perf_counter()
+                try:
+                    validator.validate_input(text)
+                except Exception as e:  # 热更新不应导致校验失败
+                    errors.append(e)
+                latencies.append(time.perf_counter() - start)
+
+        def run_phase(reload: bool) -> Dict[str, Any]:
+            latencies.clear()
+            stop = threading.Event()
+            threads = [threading.Thread(target=validate_loop, args=(stop,)) for _ in range(workers)]
+            for thread in threads:
+                thread.start()
+            reloads = 0
+            deadline = time.perf_counter() + duration
+            while time.perf_counter() < deadline:
+                if reload:
+                    write_rules(rule_sets[reloads % 2])
+                    validator.load_keyword_rules()
+                    reloads += 1
+                else:
+                    time.sleep(0.05)
+            stop.set()
+            for thread in threads:
+                thread.join()
+            return {
+                "phase": "热更新中" if reload else "无热更新",
+                "reloads": reloads,
+                "validations": len(latencies),
+                "errors": len(errors),
+                "p50_ms": AdaptiveBatchController.percentile(latencies, 0.5) * 1000,
+                "p99_ms": AdaptiveBatchController.percentile(latencies, 0.99) * 1000,
+            }
+
+        rows = [run_phase(False), run_phase(True)]
+
+    print_table(f"关键词规则热更新压测（{rules} 条规则，{workers} 个校验线程）", rows)
+    return rows
+
+
+def _stream_sanitize(validator: SecurityValidator, chunks: List[str]) -> tuple:
+    """逐块输入流式清理器，返回 (拼接后的输出, 最大保留字符数)"""
+    sanitizer = StreamingSanitizer(validator)
+    parts = [sanitizer.feed(chunk) for chunk in chunks]
+    parts.append(sanitizer.flush())
+    return "".join(parts), sanitizer.max_held
+
+
+def benchmark_streaming_sanitizer(text_size: int = 100_000) -> Dict[str, Any]:
+    """
+    模拟 LLM 逐 token 输出（每块 1~6 个字符）时的清理吞吐与最大保留字符数
+
+    对抗性分块（逐位置切分、逐字符、随机分块）的一致性由 tests/test_streaming_sanitizer.py 覆盖
+    """
+    rng = random.Random(17)
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "keywords.txt")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write("blocked_term\t内部机密\nblocked_term\tconfidential-internal\nsensitive_data\t身份证号\n")
+        validator = SecurityValidator(keyword_rules_path=path)
+
+    text = _make_security_text(text_size, rng)
+    chunks, position = [], 0
+    while position < len(text):
+        size = rng.randint(1, 6)
+        chunks.append(text[position:position + size])
+        position += size
+    start = time.perf_counter()
+    output, held = _stream_sanitize(validator, chunks)
+    seconds = time.perf_counter() - start
+    assert output == validator.sanitize_output(text), "流式清理与整段清理的结果不一致"
+    row = {
+        "chunks": len(chunks),
+        "us_per_chunk": seconds / len(chunks) * 1e6,
+        "mb_per_s": len(text) / seconds / 1e6,
+        "max_held": held,
+    }
+
+    print_table(f"StreamingSanitizer 逐 token 吞吐（{text_size // 1000} KB）", [row])
+    return row
+
+
+def _legacy_check_permissions(validator: SecurityValidator, user_id: str, action: str, resource: str) -> bool:
+    """改造前的实现：每次取角色列表与允许角色列表，嵌套扫描"""
+    user_roles = validator.user_roles_db.get(user_id, validator.default_user_roles)
+    required = validator.permission_rules.get((action, resource), validator.default_required_roles)
+    for role in user_roles:
+        if role in required:
+            return True
+    return False
+
+
+def benchmark_permission_checks(users: int = 100_000, resources: int = 1_000, roles: int = 50,
+                                checks: int = 200_000) -> List[Dict[str, Any]]:
+    """RBAC：10 万用户、1000 个资源 × 3 种操作下的单次 / 批量 / 多权限检查耗时"""
+    rng = random.Random(21)
+    role_names = [f"role{i}" for i in range(roles)]
+    validator = SecurityValidator(role_cache_size=users)
+    validator.user_roles_db = {f"user{i}": rng.sample(role_names, rng.randint(1, 4)) for i in range(users)}
+    validator.permission_rules = {
+        (action, f"resource{i}"): rng.sample(role_names, rng.randint(1, 10))
+        for i in range(resources) for action in ("read", "write", "delete")
+    }
+    start = time.perf_counter()
+    validator.invalidate_permissions()
+    compile_ms = (time.perf_counter() - start) * 1000
+
+    # 均匀随机用户：第一轮大部分是缓存未命中，第二轮全部命中
+    workload = [(f"user{rng.randrange(users)}", rng.choice(("read", "write", "delete")),
+                 f"resource{rng.randrange(resources)}") for _ in range(checks)]
+    rows = []
+
+    def timed(name: str, run: Callable[[], Any], count: int) -> Any:
+        start = time.perf_counter()
+        result = run()
+        seconds = time.perf_counter() - start
+        rows.append({"method": name, "ops_per_s": _ops_per_second(count, seconds),
+                     "us_per_check": seconds / count * 1e6})
+        return result
+
+    legacy = timed("逐条扫描", lambda: [_legacy_check_permissions(validator, *check) for check in workload], checks)
+    cold = timed("位图（冷缓存）", lambda: [validator.check_permissions(*check) for check in workload], checks)
+    warm = timed("位图（热缓存）", lambda: [validator.check_permissions(*check) for check in workload], checks)
+    batch = timed("位图批量", lambda: validator.check_permissions_batch(workload), checks)
+
+    # FastAPI 依赖项的典型用法：路由需要同时满足 3 个权限，所需位图预先计算
+    required_masks = validator.permission_masks([("read", "resource1"), ("write", "resource2"),
+                                                 ("read", "resource3")])
+    timed("多权限 has_permissions", lambda: [validator.has_permissions(user_id, required_masks)
+                                            for user_id, _, _ in workload], checks)
+
+    assert legacy == cold == warm == batch, "位图索引与逐条扫描的结果不一致"
+    print_table(f"RBAC 权限检查（{users} 用户，{resources * 3} 个权限，编译 {compile_ms:.1f} ms）", rows)
+    return rows
+
+
+# ==================== 6. 幻觉检测基准 ====================
+def _make_sentences(count: int, rng: random.Random) -> List[str]:
+    """生成空格分词的中文句子，约 5% 的词带否定前缀"""
+    vocabulary = [f"词{i}" for i in range(max(50, count // 2))] + ["正确", "安全", "可靠", "是", "支持"]
+    sentences = []
+    for _ in range(count):
+        words = []
+        for _ in range(rng.randint(4, 12)):
+            word = rng.choice(vocabulary)
+            if rng.random() < 0.05:
+                word = rng.choice(("不", "非")) + word
+            words.append(word)
+        sentences.append(" ".join(words))
+    return sentences
+
+
+def _pairwise_contradictions(detector: HallucinationDetector, sentences: List[str]) -> List[tuple]:
+    """改造前的实现：逐对调用 _are_contradictory"""
+    pairs = []
+    for i, sent1 in enumerate(sentences):
+        for j in range(i + 1, len(sentences)):
+            if detector._are_contradictory(sent1, sentences[j]):
+                pairs.append((i, j))
+    return pairs
+
+
+def benchmark_contradiction_detection(sizes: List[int] = None, pairwise_limit: int = 1_000) -> List[Dict[str, Any]]:
+    """矛盾检测耗时随句子数的增长；逐对比较超过 pairwise_limit 句时不再运行"""
+    sizes = sizes or [10, 100, 1_000, 10_000]
+    detector = HallucinationDetector()
+    rng = random.Random(23)
+    rows = []
+    for size in sizes:
+        sentences = _make_sentences(size, rng)
+        start = time.perf_counter()
+        pairs = detector._find_contradictions(sentences)
+        indexed = time.perf_counter() - start
+
+        row = {"sentences": size, "indexed_ms": indexed * 1000, "pairwise_ms": "-", "pairs": len(pairs)}
+        if size <= pairwise_limit:
+            start = time.perf_counter()
+            expected = _pairwise_contradictions(detector, sentences)
+            row["pairwise_ms"] = (time.perf_counter() - start) * 1000
+            assert pairs == expected, "倒排表与逐对比较的矛盾句对不一致"
+        rows.append(row)
+
+    print_table("HallucinationDetector 矛盾检测耗时", rows)
+    return rows
+
+
+async def benchmark_fact_verification(documents: int = 20, facts_per_document: int = 40,
+                                      latency: float = 0.02) -> List[Dict[str, Any]]:
+    """每篇文档提取数十个数字/日期事实，模拟验证服务每次请求 latency 秒"""
+    rng = random.Random(29)
+    detector = HallucinationDetector()
+    texts = [
+        "，".join(rng.choice([f"约{rng.randint(1, 9999)}万人", f"{rng.randint(1990, 2030)}年{rng.randint(1, 12)}月",
+                              f"{rng.randint(1, 999):,}{rng.randint(100, 999)}元"])
+                  for _ in range(facts_per_document))
+        for _ in range(documents)
+    ]
+    fact_lists = [detector._extract_verifiable_facts(text) for text in texts]
+    total_facts = sum(len(facts) for facts in fact_lists)
+    rows = []
+
+    # 改造前：每个事实一次请求，逐个等待
+    verifier = StubFactVerifier(latency=latency)
+    start = time.perf_counter()
+    for facts in fact_lists:
+        for fact in facts:
+            await verifier.verify_batch([fact])
+    rows.append({"mode": "逐条请求", "seconds": time.perf_counter() - start,
+                 "requests": verifier.request_count, "facts": total_facts})
+
+    verifier = StubFactVerifier(latency=latency)
+    checker = BatchFactChecker(verifier, batch_size=16, max_concurrency=4)
+    start = time.perf_counter()
+    for facts in fact_lists:
+        await checker.verify(facts)
+    rows.append({"mode": "批量（逐篇）", "seconds": time.perf_counter() - start,
+                 "requests": verifier.request_count, "facts": total_facts})
+
+    verifier = StubFactVerifier(latency=latency)
+    checker = BatchFactChecker(verifier, batch_size=16, max_concurrency=4)
+    start = time.perf_counter()
+    await asyncio.gather(*(checker.verify(facts) for facts in fact_lists))
+    rows.append({"mode": "批量（多篇并发）", "seconds": time.perf_counter() - start,
+                 "requests": verifier.request_count, "facts": total_facts})
+
+    start = time.perf_counter()
+    for facts in fact_lists:
+        await checker.verify(facts)
+    rows.append({"mode": "批量（缓存命中）", "seconds": time.perf_counter() - start,
+                 "requests": verifier.request_count, "facts": total_facts})
+
+    print_table(f"外部事实验证（{documents} 篇文档，请求延迟 {latency * 1000:.0f} ms）", rows)
+    return rows
+
+
+# ==================== 7. 上下文管理基准 ====================
+class _LegacyContextWindow:
+    """改造前的实现：每次溢出整体排序，摘要时再排序并 list.remove"""
+
+    def __init__(self, max_tokens: int, tokenizer: Callable[[str], int]):
+        self.max_tokens = max_tokens
+        self.current_tokens = 0
+        self.segments: List[Dict[str, Any]] = []
+        self.tokenizer = tokenizer
+
+    def add_segment(self, content: str, segment_type: str, priority: float = 1.0):
+        tokens = self.tokenizer(content)
+        self.segments.append({"content": content, "type": segment_type, "tokens": tokens,
+                              "priority": priority, "timestamp": time.time()})
+        self.current_tokens += tokens
+        if self.current_tokens > self.max_tokens:
+            self._compress()
+
+    def _compress(self):
+        self.segments.sort(key=lambda x: x['priority'], reverse=True)
+        while self.current_tokens > self.max_tokens * 0.8 and self.segments:
+            self.current_tokens -= self.segments.pop()['tokens']
+        if self.current_tokens > self.max_tokens * 0.6 and len(self.segments) > 3:
+            old_segments = sorted(self.segments, key=lambda x: x['timestamp'])[:2]
+            summary = "摘要：" + " ".join("\n".join(seg['content'] for seg in old_segments).split('\n')[:3])
+            for seg in old_segments:
+                self.segments.remove(seg)
+                self.current_tokens -= seg['tokens']
+            self.add_segment(summary, "summary", priority=0.8)
+
+
+def _cjk_tokenizer(text: str) -> int:
+    """较慢的"精确"分词计数：汉字逐字计一个 token，其余按词与标点切分"""
+    return len(re.findall(r'[\u4e00-\u9fff]|[A-Za-z0-9]+|[^\sA-Za-z0-9\u4e00-\u9fff]', text))
+
+
+def benchmark_context_window(segments: int = 100_000, max_tokens: int = 200_000) -> List[Dict[str, Any]]:
+    """写入 10 万段对话（约 30% 为重复的系统提示 / 工具输出），窗口可容纳约 1 万段"""
+    rng = random.Random(31)
+    templates = ["系统提示：你是一个有帮助的助手，请用中文回答。", "工具输出：查询成功，共 3 条结果。",
+                 "用户：请继续。", "助手：好的，我们接着分析这个问题。"]
+    contents = [rng.choice(templates) if rng.random() < 0.3 else
+                f"第{i}轮 用户询问 关于 主题{rng.randrange(1000)} 的 细节，" + "内容" * rng.randint(1, 20)
+                for i in range(segments)]
+    priorities = [rng.choice((0.2, 0.5, 0.8, 1.0)) for _ in range(segments)]
+    rows = []
+
+    for name, window in (("整体排序（改造前）", _LegacyContextWindow(max_tokens, _cjk_tokenizer)),
+                         ("双索引 + tokenizer 缓存", ContextWindow(max_tokens, _cjk_tokenizer))):
+        latencies = []
+        start = time.perf_counter()
+        for content, priority in zip(contents, priorities):
+            begin = time.perf_counter()
+            window.add_segment(content, "message", priority)
+            latencies.append(time.perf_counter() - begin)
+        seconds = time.perf_counter() - start
+        rows.append({
+            "implementation": name,
+            "total_s": seconds,
+            "us_per_add": seconds / segments * 1e6,
+            "max_add_ms": max(latencies) * 1000,
+            "resident": len(window.segments),
+            "tokens": window.current_tokens,
+        })
+
+    cache_info = window._count_tokens.cache_info()
+    print_table(f"ContextWindow 写入 {segments} 段（上限 {max_tokens} tokens，"
+                f"tokenizer 缓存命中率 {cache_info.hits / (cache_info.hits + cache_info.misses):.0%}）", rows)
+    return rows
+
+
+def benchmark_context_rendering(segments: int = 100_000, rounds: int = 200) -> List[Dict[str, Any]]:
+    """窗口内常驻 10 万段，每轮追加一段后取一次上下文（模拟多轮对话）"""
+    window = ContextWindow(max_tokens=10 ** 9)
+    for i in range(segments):
+        window.add_segment(f"第{i}轮 用户与助手的对话内容", "message")
+    window.get_context()
+    rows = []
+
+    start = time.perf_counter()
+    for _ in range(rounds):
+        "\n".join([segment['content'] for segment in window._segments.values()])
+    rows.append({"mode": "整体拼接（改造前）", "ms_per_call": (time.perf_counter() - start) / rounds * 1000})
+
+    start = time.perf_counter()
+    for _ in range(rounds):
+        window.get_context()
+    rows.append({"mode": "增量渲染（未变化）", "ms_per_call": (time.perf_counter() - start) / rounds * 1000})
+
+    start = time.perf_counter()
+    for i in range(rounds):
+        window.add_segment(f"新一轮 {i}", "message")
+        window.get_context()
+    rows.append({"mode": "增量渲染（每轮追加一段）", "ms_per_call": (time.perf_counter() - start) / rounds * 1000})
+
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for _ in window.iter_segments():
+            pass
+    rows.append({"mode": "iter_segments 遍历", "ms_per_call": (time.perf_counter() - start) / rounds * 1000})
+
+    assert window.get_context() == "\n".join(segment['content'] for segment in window.segments)
+    print_table(f"ContextWindow 渲染耗时（{segments} 段）", rows)
+    return rows
+
+
+def _make_memory_corpus(count: int, rng: random.Random, vocabulary_size: int = 20_000) -> tuple:
+    """生成中文记忆条目：词表中的词按 Zipf 分布抽取，每条 3~8 个词；返回 (条目, 词表)"""
+    chars = [chr(0x4e00 + i) for i in range(3_000)]
+    vocabulary = list({"".join(rng.choice(chars) for _ in range(rng.randint(2, 4)))
+                       for _ in range(vocabulary_size)})
+    weights = [1 / (rank + 1) for rank in range(len(vocabulary))]
+    words = rng.choices(vocabulary, weights=weights, k=count * 8)
+    lengths = [rng.randint(3, 8) for _ in range(count)]
+    documents, position = [], 0
+    for length in lengths:
+        documents.append("".join(words[position:position + length]))
+        position += length
+    return documents, vocabulary
+
+
+def benchmark_inverted_index(sizes: List[int] = None, queries: int = 200, k: int = 5) -> List[Dict[str, Any]]:
+    """BM25 检索延迟随长期记忆条目数的增长（目标 100 万条时 < 5 ms）"""
+    sizes = sizes or [10_000, 100_000, 1_000_000]
+    rng = random.Random(37)
+    rows = []
+    for size in sizes:
+        documents, vocabulary = _make_memory_corpus(size, rng)
+        index = InvertedIndex()
+        start = time.perf_counter()
+        for i, document in enumerate(documents):
+            index.add(f"m{i}", document)
+        build = time.perf_counter() - start
+
+        # 查询：2~3 个词，偏向中低频词
+        query_texts = [" ".join(rng.choice(vocabulary[len(vocabulary) // 50:]) for _ in range(rng.randint(2, 3)))
+                       for _ in range(queries)]
+        latencies = []
+        for query in query_texts:
+            start = time.perf_counter()
+            index.search(query, k)
+            latencies.append(time.perf_counter() - start)
+
+        # 删除 10% 后的查询延迟
+        for i in range(0, size, 10):
+            index.remove(f"m{i}")
+        start = time.perf_counter()
+        for query in query_texts:
+            index.search(query, k)
+        after_delete = (time.perf_counter() - start) / queries
+
+        memory = index.memory_usage()
+        rows.append({
+            "items": size,
+            "build_s": build,
+            "p50_ms": AdaptiveBatchController.percentile(latencies, 0.5) * 1000,
+            "p99_ms": AdaptiveBatchController.percentile(latencies, 0.99) * 1000,
+            "after_delete_ms": after_delete * 1000,
+            "terms": memory["terms"],
+            "postings_mb": memory["postings_bytes"] / 2 ** 20,
+        })
+
+    print_table(f"倒排索引 BM25 检索（top-{k}）", rows)
+    return rows
+
+
+def _make_embeddings(count: int, dim: int, rng: np.random.Generator, topics: int = 2_000) -> np.ndarray:
+    """高斯混合：每条记忆围绕某个话题中心，模拟真实嵌入的聚簇结构"""
+    centers = rng.standard_normal((topics, dim), dtype=np.float32)
+    vectors = np.empty((count, dim), dtype=np.float32)
+    for start in range(0, count, 100_000):
+        end = min(start + 100_000, count)
+        vectors[start:end] = centers[rng.integers(0, topics, end - start)]
+        vectors[start:end] += 0.6 * rng.standard_normal((end - start, dim), dtype=np.float32)
+    return vectors
+
+
+def benchmark_vector_memory(sizes: List[int] = None, dim: int = 64, queries: int = 200,
+                            k: int = 10) -> List[Dict[str, Any]]:
+    """IVF 近似检索相对全量精确检索的 recall@k 与 QPS"""
+    sizes = sizes or [100_000, 1_000_000]
+    rng = np.random.default_rng(41)
+    rows = []
+    with tempfile.TemporaryDirectory() as tmp:
+        cases = [(size, None) for size in sizes] + [(sizes[0], os.path.join(tmp, "vectors.f32"))]
+        for size, path in cases:
+            vectors = _make_embeddings(size, dim, rng)
+            store = VectorMemoryStore(dim, path=path, train_threshold=size)
+            start = time.perf_counter()
+            store.add_batch(list(range(size)), vectors)  # 达到阈值，触发训练
+            build = time.perf_counter() - start
+
+            # 查询：已有记忆加噪声（“换了说法”的同一件事）
+            targets = rng.integers(0, size, queries)
+            query_vectors = vectors[targets] + 0.3 * rng.standard_normal((queries, dim), dtype=np.float32)
+
+            start = time.perf_counter()
+            exact = [store.search(q, k, exact=True) for q in query_vectors]
+            exact_seconds = time.perf_counter() - start
+            start = time.perf_counter()
+            approx = [store.search(q, k) for q in query_vectors]
+            approx_seconds = time.perf_counter() - start
+
+            recall = sum(len({i for i, _ in a} & {i for i, _ in e}) for a, e in zip(approx, exact)) / (k * queries)
+            rows.append({
+                "items": size,
+                "storage": "memmap" if path else "memory",
+                "build_s": build,
+                "exact_qps": _ops_per_second(queries, exact_seconds),
+                "ivf_qps": _ops_per_second(queries, approx_seconds),
+                f"recall@{k}": recall,
+                "matrix_mb": store.nbytes / 2 ** 20,
+            })
+            del store, vectors
+
+    print_table(f"长期记忆向量层（dim={dim}，nprobe=16）", rows)
+    return rows
+
+
+def _current_rss_mb() -> float:
+    """当前进程的常驻内存（MB），非 Linux 返回 nan"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    except (OSError, ValueError):
+        return float("nan")
+
+
+def benchmark_memory_forgetting(writes: int = 100_000, capacity: int = 5_000,
+                                checkpoints: int = 5) -> List[Dict[str, Any]]:
+    """
+    模拟长时间运行的会话：持续写入长期记忆，每 1000 次写入检索一组“常用”记忆
+
+    有容量上限时条目数与索引内存应保持平稳，常用记忆因访问刷新而不被淘汰
+    """
+    rng = random.Random(43)
+    documents, _ = _make_memory_corpus(writes + 20, rng)
+    rows = []
+    for label, limit in (("bounded", capacity), ("unbounded", writes + 1)):
+        # decay_time 取 1 秒，使新近度在基准的时间尺度内起作用
+        manager = HierarchicalContextManager(capacity=limit, decay_time=1.0, min_retention=0.0)
+        hot = documents[:20]
+        for document in hot:
+            manager.add_information(document, "fact", 0.9)
+
+        start = time.perf_counter()
+        step = writes // checkpoints
+        for checkpoint in range(1, checkpoints + 1):
+            for position in range(20 + (checkpoint - 1) * step, 20 + checkpoint * step):
+                manager.add_information(documents[position], "fact", rng.uniform(0.8, 1.0))
+                if position % 1_000 == 0:
+                    for document in hot:
+                        manager.retrieve_relevant(document, max_items=1)
+
+            stats = manager.memory_stats()
+            hot_keys = {key for key, item in manager.long_term.items() if item["content"] in hot}
+            rows.append({
+                "mode": label,
+                "writes": checkpoint * step,
+                "items": stats["long_term_items"],
+                "evicted": stats["evicted"],
+                "hot_kept": len(hot_keys),
+                "index_mb": stats["index_bytes"] / 2 ** 20,
+                "vector_mb": stats["vector_bytes"] / 2 ** 20,
+                "rss_mb": _current_rss_mb(),
+                "writes_per_s": _ops_per_second(checkpoint * step, time.perf_counter() - start),
+            })
+        del manager
+
+    print_table(f"长期记忆渐进式遗忘（capacity={capacity:,}，两次扫描之间最多超出 {capacity // 10:,} 条，常用记忆 20 条）", rows)
+    return rows
+
+
+async def run_all_benchmarks():
+    """运行全部基准测试"""
+    print("=" * 60)
+    print("技术组件性能基准测试")
+    print("=" * 60)
+
+    benchmark_model_cache()
+    benchmark_semantic_cache()
+    benchmark_single_flight_threads()
+    await benchmark_single_flight_async()
+    await benchmark_adaptive_batching()
+    await benchmark_priority_lanes()
+    await benchmark_process_pool()
+    benchmark_load_balancer()
+    await benchmark_load_balancer_latency()
+    simulate_cache_affinity()
+    benchmark_key_movement()
+    benchmark_performance_monitor()
+    await benchmark_span_overhead()
+    await benchmark_metrics_middleware()
+    benchmark_security_scanner()
+    benchmark_keyword_engine()
+    stress_keyword_hot_reload()
+    benchmark_streaming_sanitizer()
+    benchmark_permission_checks()
+    benchmark_contradiction_detection()
+    await benchmark_fact_verification()
+    benchmark_context_window()
+    benchmark_context_rendering()
+    benchmark_inverted_index()
+    benchmark_vector_memory()
+    benchmark_memory_forgetting()
+
+
+if __name__ == "__main__":
+    asyncio.run(run_all_benchmarks())
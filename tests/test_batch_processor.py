@@ -0,0 +1,368 @@
+import asyncio
+import os
+import threading
+import time
+
+import pytest
+
+from technical_analysis import AdaptiveBatchController, BatchProcessor, DeadlineExceededError, QueueFullError
+
+
+class RecordingHandler:
+    """记录每个批次的请求，返回 x * 2"""
+
+    def __init__(self, delay=0.0, error=None):
+        self.delay = delay
+        self.error = error
+        self.batches = []
+
+    async def __call__(self, requests):
+        self.batches.append([r["x"] for r in requests])
+        await asyncio.sleep(self.delay)
+        if self.error is not None:
+            raise self.error
+        return [r["x"] * 2 for r in requests]
+
+
+def test_full_batch_is_sent_without_waiting_for_timeout():
+    handler = RecordingHandler()
+
+    async def main():
+        async with BatchProcessor(batch_size=4, timeout=10.0, batch_handler=handler) as processor:
+            started = time.perf_counter()
+            results = await asyncio.gather(*(processor.add_request({"x": i}) for i in range(4)))
+            return results, time.perf_counter() - started
+
+    results, elapsed = asyncio.run(main())
+    assert results == [0, 2, 4, 6]
+    assert handler.batches == [[0, 1, 2, 3]]
+    assert elapsed < 1.0
+
+
+def test_partial_batch_is_sent_after_timeout():
+    handler = RecordingHandler()
+
+    async def main():
+        async with BatchProcessor(batch_size=100, timeout=0.05, batch_handler=handler) as processor:
+            started = time.perf_counter()
+            results = await asyncio.gather(*(processor.add_request({"x": i}) for i in range(3)))
+            return results, time.perf_counter() - started
+
+    results, elapsed = asyncio.run(main())
+    assert results == [0, 2, 4]
+    assert handler.batches == [[0, 1, 2]]
+    assert elapsed >= 0.05
+
+
+def test_results_map_back_to_their_callers():
+    handler = RecordingHandler(delay=0.001)
+
+    async def main():
+        async with BatchProcessor(batch_size=7, timeout=0.01, batch_handler=handler) as processor:
+            return await asyncio.gather(*(processor.add_request({"x": i}) for i in range(100)))
+
+    assert asyncio.run(main()) == [i * 2 for i in range(100)]
+    assert sorted(x for batch in handler.batches for x in batch) == list(range(100))
+    assert max(len(batch) for batch in handler.batches) <= 7
+
+
+def test_cancelled_caller_is_dropped_from_the_batch():
+    handler = RecordingHandler()
+
+    async def main():
+        async with BatchProcessor(batch_size=10, timeout=0.1, batch_handler=handler) as processor:
+            tasks = [asyncio.create_task(processor.add_request({"x": i})) for i in range(3)]
+            await asyncio.sleep(0.01)
+            tasks[1].cancel()
+            return await asyncio.gather(*tasks, return_exceptions=True)
+
+    first, cancelled, third = asyncio.run(main())
+    assert (first, third) == (0, 4)
+    assert isinstance(cancelled, asyncio.CancelledError)
+    assert handler.batches == [[0, 2]]
+
+
+@pytest.mark.parametrize("error", [RuntimeError("backend down"), ValueError("bad input")])
+def test_handler_exception_reaches_every_caller(error):
+    handler = RecordingHandler(error=error)
+
+    async def main():
+        async with BatchProcessor(batch_size=4, timeout=0.01, batch_handler=handler) as processor:
+            return await asyncio.gather(*(processor.add_request({"x": i}) for i in range(4)),
+                                        return_exceptions=True)
+
+    assert asyncio.run(main()) == [error] * 4
+
+
+def test_result_count_mismatch_fails_the_batch():
+    async def short_handler(requests):
+        return [None] * (len(requests) - 1)
+
+    async def main():
+        async with BatchProcessor(batch_size=3, timeout=0.01, batch_handler=short_handler) as processor:
+            return await asyncio.gather(*(processor.add_request({"x": i}) for i in range(3)),
+                                        return_exceptions=True)
+
+    assert all(isinstance(r, ValueError) for r in asyncio.run(main()))
+
+
+def test_cancellation_inside_handler_does_not_strand_callers():
+    handler = RecordingHandler(error=asyncio.CancelledError())
+
+    async def main():
+        processor = BatchProcessor(batch_size=2, timeout=0.01, batch_handler=handler)
+        results = await asyncio.wait_for(
+            asyncio.gather(*(processor.add_request({"x": i}) for i in range(2)), return_exceptions=True),
+            timeout=2.0
+        )
+        # 处理器仍可继续使用
+        handler.error = None
+        after = await asyncio.wait_for(processor.add_request({"x": 5}), timeout=2.0)
+        await processor.close()
+        return results, after
+
+    results, after = asyncio.run(main())
+    assert all(isinstance(r, asyncio.CancelledError) for r in results)
+    assert after == 10
+
+
+def test_reject_policy_raises_when_queue_is_full():
+    handler = RecordingHandler()
+
+    async def main():
+        async with BatchProcessor(batch_size=10, timeout=0.1, batch_handler=handler,
+                                  max_queue_size=2, overflow_policy="reject") as processor:
+            queued = [asyncio.create_task(processor.add_request({"x": i})) for i in range(2)]
+            await asyncio.sleep(0)
+            with pytest.raises(QueueFullError):
+                await processor.add_request({"x": 2})
+            return await asyncio.gather(*queued), processor.get_stats()
+
+    results, stats = asyncio.run(main())
+    assert results == [0, 2]
+    assert stats["rejected"] == 1
+
+
+def test_shed_oldest_policy_fails_the_oldest_request():
+    handler = RecordingHandler()
+
+    async def main():
+        async with BatchProcessor(batch_size=10, timeout=0.1, batch_handler=handler,
+                                  max_queue_size=2, overflow_policy="shed_oldest") as processor:
+            tasks = []
+            for i in range(4):
+                tasks.append(asyncio.create_task(processor.add_request({"x": i})))
+                await asyncio.sleep(0)
+            return await asyncio.gather(*tasks, return_exceptions=True), processor.get_stats()
+
+    results, stats = asyncio.run(main())
+    assert all(isinstance(r, QueueFullError) for r in results[:2])
+    assert results[2:] == [4, 6]
+    assert handler.batches == [[2, 3]]
+    assert stats["shed"] == 2
+
+
+def test_block_policy_waits_for_space_instead_of_failing():
+    handler = RecordingHandler()
+    peak = 0
+
+    async def main():
+        nonlocal peak
+        async with BatchProcessor(batch_size=10, timeout=0.05, batch_handler=handler,
+                                  max_queue_size=2, overflow_policy="block") as processor:
+            tasks = [asyncio.create_task(processor.add_request({"x": i})) for i in range(5)]
+            while not all(task.done() for task in tasks):
+                peak = max(peak, processor.pending_count)
+                await asyncio.sleep(0.005)
+            return [task.result() for task in tasks], processor.get_stats()
+
+    results, stats = asyncio.run(main())
+    assert results == [0, 2, 4, 6, 8]
+    assert stats["blocked"] >= 1 and stats["rejected"] == 0
+    assert peak <= 2
+    assert len(handler.batches) == 3
+
+
+def test_controller_shrinks_batch_when_p99_exceeds_target():
+    controller = AdaptiveBatchController(latency_target=0.1, batch_size=40, linger=0.02, adjust_every=2)
+    for _ in range(2):
+        controller.observe(40, [0.15] * 40, handler_latency=0.02)
+    assert controller.batch_size == 28
+    assert controller.linger == pytest.approx(0.014)
+    assert not controller.latencies
+
+
+def test_controller_grows_full_batches_and_lingers_longer_on_partial_ones():
+    controller = AdaptiveBatchController(latency_target=0.1, batch_size=16, linger=0.01, adjust_every=2)
+    for _ in range(2):
+        controller.observe(16, [0.001] * 16, handler_latency=0.01)
+    assert controller.batch_size == 18
+    assert controller.linger == pytest.approx(0.01)
+
+    for _ in range(2):
+        controller.observe(3, [0.001] * 3, handler_latency=0.01)
+    assert controller.batch_size == 18
+    assert controller.linger == pytest.approx(0.011)
+
+
+def test_controller_caps_linger_by_backend_latency():
+    controller = AdaptiveBatchController(latency_target=0.1, batch_size=8, linger=0.5, adjust_every=1)
+    controller.observe(1, [0.0], handler_latency=0.06)
+    assert controller.linger == pytest.approx(0.04)
+
+
+def test_processor_adapts_batch_size_under_latency_target():
+    async def slow_handler(requests):
+        await asyncio.sleep(0.02)
+        return [r["x"] for r in requests]
+
+    async def main():
+        async with BatchProcessor(batch_size=32, timeout=0.05, batch_handler=slow_handler,
+                                  latency_target=0.01) as processor:
+            # 每 5 个批次调整一次
+            for _ in range(6):
+                await asyncio.gather(*(processor.add_request({"x": i}) for i in range(32)))
+            return processor.current_batch_size, processor.current_timeout
+
+    batch_size, linger = asyncio.run(main())
+    assert batch_size < 32
+    assert linger < 0.05
+
+
+def test_batches_are_built_in_earliest_deadline_order():
+    handler = RecordingHandler(delay=0.01)
+
+    async def main():
+        lanes = {"high": None, "low": None}
+        async with BatchProcessor(batch_size=2, timeout=0.01, batch_handler=handler,
+                                  lanes=lanes, max_inflight_batches=1) as processor:
+            requests = [(0, "low", 50.0), (1, "low", 10.0), (2, "high", None), (3, "high", 30.0),
+                        (4, "low", 30.0), (5, "low", 20.0)]
+            await asyncio.gather(*(processor.add_request({"x": x}, priority=lane, deadline=deadline)
+                                   for x, lane, deadline in requests))
+
+    asyncio.run(main())
+    # 截止时间相同时高优先级通道在前，不限截止时间的请求最后
+    assert handler.batches == [[1, 5], [3, 4], [0, 2]]
+
+
+def test_expired_requests_fail_with_deadline_exceeded():
+    handler = RecordingHandler(delay=0.1)
+
+    async def main():
+        async with BatchProcessor(batch_size=1, timeout=0.001, batch_handler=handler,
+                                  max_inflight_batches=1) as processor:
+            first = asyncio.create_task(processor.add_request({"x": 1}))
+            await asyncio.sleep(0.01)
+            results = await asyncio.gather(processor.add_request({"x": 2}, deadline=0.02),
+                                           processor.add_request({"x": 3}, deadline=1.0),
+                                           return_exceptions=True)
+            return await first, results, processor.get_stats()
+
+    first, (expired, ok), stats = asyncio.run(main())
+    assert (first, ok) == (2, 6)
+    assert isinstance(expired, DeadlineExceededError)
+    assert handler.batches == [[1], [3]]
+    assert stats["expired"] == 1 and stats["lanes"]["default"]["expired"] == 1
+
+
+def test_top_lane_is_not_stuck_behind_inflight_bulk_batches():
+    handler = RecordingHandler(delay=0.1)
+
+    async def main():
+        lanes = {"interactive": None, "bulk": None}
+        async with BatchProcessor(batch_size=8, timeout=0.001, batch_handler=handler,
+                                  lanes=lanes, max_inflight_batches=2) as processor:
+            bulk = [asyncio.create_task(processor.add_request({"x": i}, priority="bulk")) for i in range(64)]
+            await asyncio.sleep(0.01)
+            started = time.perf_counter()
+            result = await processor.add_request({"x": 100}, priority="interactive")
+            elapsed = time.perf_counter() - started
+            await asyncio.gather(*bulk)
+            return result, elapsed
+
+    result, elapsed = asyncio.run(main())
+    assert result == 200
+    # 预留槽位让交互请求一个后端耗时内完成，而不是排在 8 个批量批次之后
+    assert elapsed < 0.3
+    # 交互请求单独成批，不与批量任务混在一起
+    assert [100] in handler.batches
+
+
+def test_reserved_slots_must_leave_a_shared_slot():
+    with pytest.raises(ValueError):
+        BatchProcessor(lanes={"a": None, "b": None}, max_inflight_batches=2, reserved_slots=2)
+    assert BatchProcessor(max_inflight_batches=4).reserved_slots == 0
+    assert BatchProcessor(lanes={"a": None, "b": None}, max_inflight_batches=1).reserved_slots == 0
+
+
+def square_in_worker(requests):
+    """进程模式的批处理函数（模块级，可被 pickle）"""
+    return [(r["x"] ** 2, os.getpid()) for r in requests]
+
+
+def test_thread_mode_runs_sync_handler_off_the_event_loop():
+    loop_thread = threading.get_ident()
+    handler_threads = []
+
+    def blocking_handler(requests):
+        handler_threads.append(threading.get_ident())
+        time.sleep(0.01)
+        return [r["x"] + 1 for r in requests]
+
+    async def main():
+        async with BatchProcessor(batch_size=4, timeout=0.01, batch_handler=blocking_handler,
+                                  execution_mode="thread", max_workers=2) as processor:
+            return await asyncio.gather(*(processor.add_request({"x": i}) for i in range(10)))
+
+    assert asyncio.run(main()) == list(range(1, 11))
+    assert handler_threads and loop_thread not in handler_threads
+
+
+def test_thread_mode_handler_exception_reaches_callers():
+    def failing_handler(requests):
+        raise RuntimeError("blocking call failed")
+
+    async def main():
+        async with BatchProcessor(batch_size=2, timeout=0.01, batch_handler=failing_handler,
+                                  execution_mode="thread") as processor:
+            return await asyncio.gather(*(processor.add_request({"x": i}) for i in range(2)),
+                                        return_exceptions=True)
+
+    assert all(isinstance(r, RuntimeError) for r in asyncio.run(main()))
+
+
+def test_process_mode_splits_batches_and_keeps_order():
+    async def main():
+        async with BatchProcessor(batch_size=8, timeout=0.01, batch_handler=square_in_worker,
+                                  execution_mode="process", max_workers=2) as processor:
+            return await asyncio.gather(*(processor.add_request({"x": i}) for i in range(8)))
+
+    results = asyncio.run(main())
+    assert [value for value, _ in results] == [i ** 2 for i in range(8)]
+    assert os.getpid() not in {pid for _, pid in results}
+
+
+def test_process_mode_rejects_unpicklable_handler():
+    with pytest.raises(ValueError):
+        BatchProcessor(batch_handler=lambda requests: requests, execution_mode="process")
+    with pytest.raises(ValueError):
+        BatchProcessor(execution_mode="thread")
+
+
+@pytest.mark.parametrize("mode, handler", [
+    ("thread", lambda requests: [r["x"] for r in requests]),
+    ("process", square_in_worker),
+])
+def test_close_shuts_down_the_executor(mode, handler):
+    async def main():
+        processor = BatchProcessor(batch_size=1, timeout=0.01, batch_handler=handler, execution_mode=mode)
+        await processor.add_request({"x": 3})
+        executor = processor._executor
+        await processor.close()
+        return processor, executor
+
+    processor, executor = asyncio.run(main())
+    assert executor is not None and processor._executor is None
+    with pytest.raises(RuntimeError):
+        executor.submit(len, [])
@@ -0,0 +1,94 @@
+import random
+
+import pytest
+
+from technical_analysis import ContextWindow
+
+
+class ReferenceWindow:
+    """按 ContextWindow 文档描述的语义逐步线性扫描的参考实现"""
+
+    def __init__(self, max_tokens, tokenizer):
+        self.max_tokens = max_tokens
+        self.tokenizer = tokenizer
+        self.segments = []  # [(序号, 优先级, 内容)]，按上下文顺序
+        self.seq = 0
+
+    @property
+    def tokens(self):
+        return sum(self.tokenizer(content) for _, _, content in self.segments)
+
+    def insert(self, content, priority, front=False):
+        segment = (self.seq, priority, content)
+        self.seq += 1
+        if front:
+            self.segments.insert(0, segment)
+        else:
+            self.segments.append(segment)
+
+    def add_segment(self, content, priority):
+        self.insert(content, priority)
+        if self.tokens <= self.max_tokens:
+            return
+        while self.tokens > self.max_tokens * 0.8 and self.segments:
+            self.segments.remove(min(self.segments, key=lambda s: (s[1], s[0])))
+        if self.tokens > self.max_tokens * 0.6 and len(self.segments) > 3:
+            old = self.segments[:2]
+            del self.segments[:2]
+            combined = "\n".join(content for _, _, content in old)
+            self.insert("摘要：" + " ".join(combined.split("\n")[:3]), 0.8, front=True)
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_matches_reference_under_random_workload(seed):
+    rng = random.Random(seed)
+    window = ContextWindow(max_tokens=300, tokenizer=len, token_cache_size=64)
+    reference = ReferenceWindow(300, len)
+    for i in range(2_000):
+        content = f"段{i}" + "内容" * rng.randint(0, 15)
+        if rng.random() < 0.2:
+            content += "\n第二行"
+        priority = rng.choice((0.2, 0.5, 0.8, 1.0))
+        window.add_segment(content, "message", priority)
+        reference.add_segment(content, priority)
+
+        assert window.current_tokens == reference.tokens
+        if i % 97 == 0:
+            assert [s["content"] for s in window.segments] == [c for _, _, c in reference.segments]
+            assert window.get_context() == "\n".join(c for _, _, c in reference.segments)
+
+    assert [s["content"] for s in window.segments] == [c for _, _, c in reference.segments]
+    assert window.get_context() == "\n".join(c for _, _, c in reference.segments)
+    assert list(window.iter_segments()) == [c for _, _, c in reference.segments]
+
+
+def test_tokenizer_runs_once_per_distinct_content():
+    calls = []
+
+    def tokenizer(text):
+        calls.append(text)
+        return len(text)
+
+    window = ContextWindow(max_tokens=10 ** 6, tokenizer=tokenizer)
+    for _ in range(100):
+        window.add_segment("系统提示", "system")
+        window.add_segment("工具输出", "tool")
+    assert sorted(calls) == ["工具输出", "系统提示"]
+    assert window.current_tokens == 800
+
+
+def test_incremental_render_matches_full_render_after_every_change():
+    rng = random.Random(7)
+    window = ContextWindow(max_tokens=2_000, tokenizer=len)
+    for i in range(3_000):
+        content = "" if rng.random() < 0.05 else f"段{i}" + "字" * rng.randint(0, 40)
+        if rng.random() < 0.1:
+            content += "\n续行"
+        window.add_segment(content, "message", rng.choice((0.2, 0.5, 1.0)))
+        full = "\n".join(segment["content"] for segment in window.segments)
+        assert window.get_context() == full
+        assert window.get_context() is window.get_context()  # 未变化时直接返回缓存
+        assert "\n".join(window.iter_segments()) == full
+    # 压缩与摘要已多次发生，且窗口跨越了多个分块
+    assert len(window) > ContextWindow.CHUNK_SIZE
+    assert any(segment["type"] == "summary" for segment in window.segments)
@@ -0,0 +1,63 @@
+import asyncio
+import random
+
+import pytest
+
+from technical_analysis import BatchFactChecker, HallucinationDetector, StubFactVerifier
+
+
+def make_sentences(count, rng):
+    vocabulary = [f"词{i}" for i in range(max(50, count // 2))] + ["正确", "安全", "可靠", "是", "支持"]
+    sentences = []
+    for _ in range(count):
+        words = []
+        for _ in range(rng.randint(4, 12)):
+            word = rng.choice(vocabulary)
+            if rng.random() < 0.05:
+                word = rng.choice(HallucinationDetector.NEGATION_PREFIXES) + word
+            words.append(word)
+        sentences.append(" ".join(words))
+    return sentences
+
+
+def pairwise(detector, sentences):
+    return [(i, j) for i in range(len(sentences)) for j in range(i + 1, len(sentences))
+            if detector._are_contradictory(sentences[i], sentences[j])]
+
+
+@pytest.mark.parametrize("count", [0, 1, 10, 200])
+def test_indexed_contradictions_match_pairwise(count):
+    detector = HallucinationDetector()
+    sentences = make_sentences(count, random.Random(count))
+    assert detector._find_contradictions(sentences) == pairwise(detector, sentences)
+
+
+def test_substring_and_prefix_edge_cases():
+    detector = HallucinationDetector()
+    sentences = ["系统 安全", "系统 不安全", "不 安全 说明", "非安全性 测试", "不不安全", "", "   "]
+    assert detector._find_contradictions(sentences) == pairwise(detector, sentences)
+
+
+@pytest.mark.parametrize("text, facts", [
+    ("2024/1/5", ["日期: 2024-01-05"]),
+    ("2024 年 1 月 5 日", ["日期: 2024-01-05"]),
+    ("2024-02-29", ["日期: 2024-02-29"]),
+    ("2024-56-01", ["数字: 2024", "数字: 56", "数字: 1"]),
+    ("2023年2月30日", ["数字: 2023", "数字: 2", "数字: 30"]),
+    ("2023-02-29", ["数字: 2023", "数字: 2", "数字: 29"]),
+    ("2024年13月", ["数字: 13", "日期: 2024年"]),
+    ("2024年1月 1.2万", ["数字: 12000", "日期: 2024-01"]),
+    ("2024-1/5", ["数字: 2024", "数字: 1", "数字: 5"]),
+])
+def test_only_real_dates_are_normalized(text, facts):
+    assert HallucinationDetector()._extract_verifiable_facts(text) == facts
+
+
+def test_fact_checker_built_outside_loop_works_across_loops():
+    verifier = StubFactVerifier(latency=0.001)
+    checker = BatchFactChecker(verifier, batch_size=2, max_concurrency=1)
+    first = asyncio.run(checker.verify(["a", "b", "c"]))
+    second = asyncio.run(checker.verify(["d", "e", "a"]))
+    assert set(first) == {"a", "b", "c"}
+    assert set(second) == {"d", "e", "a"}
+    assert verifier.fact_count == 5
@@ -0,0 +1,93 @@
+import asyncio
+import random
+
+from technical_analysis import HierarchicalContextManager
+
+
+def test_cached_context_still_records_access():
+    manager = HierarchicalContextManager()
+    manager.add_information("用户偏好使用 Python 编写脚本", "preference", 0.9)
+    manager.add_information("项目截止日期是下周五", "fact", 0.9)
+
+    first = manager.get_current_context("Python 脚本")
+    accessed = [item for item in manager.long_term.values() if item["access_count"]]
+    assert accessed
+    counts = [item["access_count"] for item in accessed]
+
+    for _ in range(3):
+        assert manager.get_current_context("Python 脚本") == first
+    assert [item["access_count"] for item in accessed] == [count + 3 for count in counts]
+
+
+def test_stale_memories_forgotten_on_read_after_sweep_period():
+    manager = HierarchicalContextManager(decay_time=10.0, min_retention=0.1, sweep_period=60.0)
+    manager.add_information("很久以前的一条记忆", "fact", 0.9)
+    manager.add_information("刚刚用过的一条记忆", "fact", 0.9)
+    stale, fresh = manager.long_term.values()
+    stale["last_accessed"] -= 1_000
+    manager._last_sweep -= 120
+
+    manager.get_current_context()
+    assert list(manager.long_term.values()) == [fresh]
+    assert manager.evicted == 1
+
+
+def test_background_eviction_loop_forgets_while_idle():
+    manager = HierarchicalContextManager(decay_time=10.0, min_retention=0.1)
+    manager.add_information("闲置会话中的记忆", "fact", 0.9)
+    next(iter(manager.long_term.values()))["last_accessed"] -= 1_000
+
+    async def main():
+        task = asyncio.create_task(manager.run_eviction_loop(interval=0.01))
+        await asyncio.sleep(0.05)
+        task.cancel()
+
+    asyncio.run(main())
+    assert not manager.long_term
+
+
+def test_capacity_overshoot_is_bounded_by_sweep_interval():
+    manager = HierarchicalContextManager(capacity=100, min_retention=0.0)
+    peak = 0
+    for i in range(1_000):
+        manager.add_information(f"记忆 {i}", "fact", 0.9)
+        peak = max(peak, len(manager.long_term))
+    assert peak <= 100 + 100 // 10
+    assert manager.evict() >= 0 and len(manager.long_term) <= 100
+
+
+def full_render(manager, query):
+    """不使用任何缓存，从各层当前内容重新拼出上下文"""
+    parts = []
+    if query:
+        relevant = [manager.long_term[key]["content"] for key, _ in manager._hybrid_search(query, 5)]
+        if relevant:
+            parts.append("相关历史信息：\n" + "\n".join(relevant))
+    for header, window in (("当前工作记忆：\n", manager.working), ("最近信息：\n", manager.short_term)):
+        text = "\n".join(segment["content"] for segment in window.segments)
+        if text:
+            parts.append(header + text)
+    return "\n\n".join(parts)
+
+
+def test_incremental_context_matches_full_render():
+    rng = random.Random(3)
+    topics = ["部署", "数据库", "缓存", "权限", "监控"]
+    manager = HierarchicalContextManager(tokenizer=len, capacity=20)
+    added = {0.3: 0, 0.6: 0, 0.9: 0}
+    for i in range(600):
+        importance = rng.choice((0.3, 0.6, 0.9))
+        added[importance] += 1
+        topic = rng.choice(topics)
+        manager.add_information(f"{topic} 记录{i} " + "细节" * rng.randint(0, 30), "note", importance)
+        query = rng.choice(["", *topics])
+        context = manager.get_current_context(query)
+        assert context == full_render(manager, query)
+        assert manager.get_current_context(query) == context
+        if i % 50 == 0:
+            assert "".join(manager.iter_current_context(query)) == context
+
+    # 三层都发生过淘汰：长期记忆超出容量被遗忘，两个窗口被压缩
+    assert manager.evicted > 0
+    assert len(manager.working) < added[0.6]
+    assert len(manager.short_term) < added[0.3]
@@ -0,0 +1,79 @@
+import numpy as np
+import pytest
+
+from technical_analysis import SlidingWindowHistogram, StreamingHistogram
+
+QUANTILES = [0.0, 0.01, 0.25, 0.5, 0.9, 0.99, 0.999, 1.0]
+SECOND = 1_000_000_000
+
+
+def sample(kind, rng, size=50_000):
+    if kind == "lognormal":
+        return rng.lognormal(mean=14, sigma=1.5, size=size).astype(np.int64)  # 约 1ms 量级的纳秒延迟
+    if kind == "uniform":
+        return rng.integers(0, 10_000_000, size=size)
+    return np.concatenate([rng.integers(50, 200, size=size - 100), rng.integers(10**9, 10**10, size=100)])
+
+
+@pytest.mark.parametrize("kind", ["lognormal", "uniform", "bimodal"])
+@pytest.mark.parametrize("precision_bits", [5, 7, 10])
+def test_percentiles_match_numpy_within_precision(kind, precision_bits):
+    values = sample(kind, np.random.default_rng(precision_bits))
+    histogram = StreamingHistogram(precision_bits)
+    histogram.record_many(values)
+
+    # 最近秩法与 numpy 的 inverted_cdf 一致；桶中点的相对误差不超过 2^-(precision_bits + 1)
+    expected = np.quantile(values, QUANTILES, method="inverted_cdf")
+    for estimate, exact in zip(histogram.percentiles(QUANTILES), expected):
+        assert abs(estimate - exact) <= exact * 2 ** -(precision_bits + 1) + 0.5
+    assert histogram.count == len(values)
+    assert (histogram.min, histogram.max) == (values.min(), values.max())
+
+
+def test_record_many_and_merge_match_scalar_records():
+    values = sample("lognormal", np.random.default_rng(0), size=5_000)
+    scalar = StreamingHistogram()
+    for value in values.tolist():
+        scalar.record(value)
+
+    left, right = StreamingHistogram(), StreamingHistogram()
+    left.record_many(values[:2_000])
+    right.record_many(values[2_000:])
+    left.merge(right)
+
+    assert left.counts == scalar.counts
+    assert left.percentiles(QUANTILES) == scalar.percentiles(QUANTILES)
+    with pytest.raises(ValueError):
+        left.merge(StreamingHistogram(precision_bits=5))
+
+
+def test_empty_histogram_has_no_percentiles():
+    assert StreamingHistogram().percentiles([0.5, 0.99]) == [None, None]
+
+
+def test_sliding_window_expires_old_slots():
+    window = SlidingWindowHistogram(window_seconds=60, slot_seconds=10)
+    window.record(1_000, now_ns=0)
+    window.record(2_000, now_ns=35 * SECOND)
+
+    assert window.snapshot(60, now_ns=40 * SECOND).count == 2
+    assert window.snapshot(10, now_ns=39 * SECOND).percentile(0.5) == 2_000
+    # 65 秒后第一个槽已滑出窗口
+    recent = window.snapshot(60, now_ns=65 * SECOND)
+    assert recent.count == 1 and recent.max == 2_000
+    # 环形复用同一位置时旧数据被清空
+    window.record(3_000, now_ns=61 * SECOND)
+    assert window.snapshot(60, now_ns=61 * SECOND).min == 2_000
+    assert window.snapshot(60, now_ns=200 * SECOND).count == 0
+
+
+def test_sliding_window_record_many_skips_data_older_than_window():
+    window = SlidingWindowHistogram(window_seconds=60, slot_seconds=10)
+    window.record(5, now_ns=100 * SECOND)
+    values = np.array([1, 2, 3, 4])
+    times = np.array([1, 2, 95, 99]) * SECOND  # 前两个与第 100 秒的槽位冲突且更早
+    window.record_many(values, times)
+
+    snapshot = window.snapshot(60, now_ns=100 * SECOND)
+    assert snapshot.count == 3
+    assert snapshot.min == 3 and snapshot.max == 5
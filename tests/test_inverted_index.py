@@ -0,0 +1,94 @@
+import math
+import random
+from collections import Counter
+
+import pytest
+
+from technical_analysis import HierarchicalContextManager, InvertedIndex
+
+
+def make_corpus(count, rng):
+    chars = [chr(0x4e00 + i) for i in range(200)]
+    vocabulary = list({"".join(rng.choice(chars) for _ in range(rng.randint(2, 4))) for _ in range(500)}) \
+        + ["model", "cache", "Python"]
+    weights = [1 / (rank + 1) for rank in range(len(vocabulary))]
+    documents = {f"m{i}": " ".join(rng.choices(vocabulary, weights=weights, k=rng.randint(3, 8)))
+                 for i in range(count)}
+    return documents, vocabulary
+
+
+def brute_force_bm25(index, documents, query):
+    """逐条文档重新分词计算 BM25，返回 {条目: 分数}（只含正分）"""
+    tokenized = {key: Counter(index.tokenize(text)) for key, text in documents.items()}
+    n = len(tokenized)
+    average = sum(sum(counts.values()) for counts in tokenized.values()) / n
+    query_terms = set(index.tokenize(query))
+    df = {term: sum(1 for counts in tokenized.values() if term in counts) for term in query_terms}
+    scores = {}
+    for key, counts in tokenized.items():
+        length = sum(counts.values())
+        score = sum(
+            math.log(1 + (n - df[term] + 0.5) / (df[term] + 0.5)) * counts[term] * (index.k1 + 1)
+            / (counts[term] + index.k1 * (1 - index.b + index.b * length / average))
+            for term in query_terms if counts[term]
+        )
+        if score > 0:
+            scores[key] = score
+    return scores
+
+
+def assert_same_ranking(index, documents, query, k):
+    expected = brute_force_bm25(index, documents, query)
+    actual = index.search(query, k)
+    # 同分条目的先后不作要求：比较前 k 个分数，并核对每个返回条目自身的分数
+    assert [score for _, score in actual] == pytest.approx(sorted(expected.values(), reverse=True)[:k], rel=1e-6)
+    assert [score for _, score in actual] == pytest.approx([expected[key] for key, _ in actual], rel=1e-6)
+
+
+def test_search_matches_brute_force_bm25():
+    rng = random.Random(37)
+    documents, vocabulary = make_corpus(2_000, rng)
+    index = InvertedIndex()
+    for key, text in documents.items():
+        index.add(key, text)
+    for _ in range(50):
+        assert_same_ranking(index, documents, " ".join(rng.choice(vocabulary) for _ in range(2)), 5)
+
+
+def test_search_matches_brute_force_after_deletes_and_compaction():
+    rng = random.Random(41)
+    documents, vocabulary = make_corpus(1_000, rng)
+    index = InvertedIndex()
+    for key, text in documents.items():
+        index.add(key, text)
+    for i in range(0, 1_000, 2):
+        index.remove(f"m{i}")
+        del documents[f"m{i}"]
+    index._compact()
+    for _ in range(30):
+        assert_same_ranking(index, documents, " ".join(rng.choice(vocabulary) for _ in range(2)), 5)
+
+
+def test_cjk_bigrams_and_ascii_words():
+    index = InvertedIndex()
+    assert index.tokenize("长期记忆 Model，Ｃａｃｈｅ") == ["长期", "期记", "记忆", "model", "cache"]
+    assert index.tokenize("好") == ["好"]
+
+
+def test_search_with_only_punctuation_documents():
+    index = InvertedIndex()
+    index.add("p", "!!!")
+    assert index.search("!!!") == []
+    assert index.search("模型") == []
+
+    # 已删除文档的倒排表还在，但存活文档没有词项
+    index.add("w", "长期记忆")
+    index.remove("w")
+    assert index.search("长期记忆") == []
+
+
+def test_context_manager_with_punctuation_only_memory():
+    manager = HierarchicalContextManager(hybrid_weight=0.0)
+    manager.add_information("!!!", "note", 0.9)
+    assert manager.retrieve_relevant("长期记忆") == []
+    assert manager.get_current_context("长期记忆") == ""
@@ -0,0 +1,118 @@
+import os
+import random
+import threading
+
+import pytest
+
+from technical_analysis import AhoCorasickAutomaton, SecurityValidator
+
+
+def brute_force(keywords, text, ignore_case=True):
+    haystack = text.lower() if ignore_case else text
+    matches = []
+    for keyword, category in keywords:
+        needle = keyword.lower() if ignore_case else keyword
+        start = haystack.find(needle)
+        while start != -1:
+            matches.append((start, start + len(keyword), keyword, category))
+            start = haystack.find(needle, start + 1)
+    return sorted(matches)
+
+
+def test_overlapping_and_nested_keywords():
+    keywords = [("he", "a"), ("she", "a"), ("his", "b"), ("hers", "b")]
+    automaton = AhoCorasickAutomaton(keywords)
+    assert sorted(automaton.scan("ushers")) == [(1, 4, "she", "a"), (2, 4, "he", "a"), (2, 6, "hers", "b")]
+    assert sorted(automaton.scan("ahishers")) == brute_force(keywords, "ahishers")
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_random_keywords_match_brute_force(seed):
+    rng = random.Random(seed)
+    alphabet = "abAB敏感词"
+    keywords = list({("".join(rng.choice(alphabet) for _ in range(rng.randint(1, 4))), f"c{i % 3}")
+                     for i in range(30)})
+    text = "".join(rng.choice(alphabet + " ") for _ in range(2_000))
+    for ignore_case in (True, False):
+        automaton = AhoCorasickAutomaton(keywords, ignore_case=ignore_case)
+        assert sorted(automaton.scan(text)) == brute_force(keywords, text, ignore_case)
+
+
+def test_cjk_keywords():
+    keywords = [("敏感词", "blocked"), ("感词", "blocked"), ("词汇表", "review"), ("機密", "secret")]
+    automaton = AhoCorasickAutomaton(keywords)
+    text = "这是敏感词汇表，含機密与敏感資訊"
+    assert sorted(automaton.scan(text)) == brute_force(keywords, text)
+    assert {keyword for _, _, keyword, _ in automaton.scan(text)} == {"敏感词", "感词", "词汇表", "機密"}
+    # 流式输出时需保留可能是关键词前缀的尾部
+    assert automaton.suffix_prefix_length("前面是敏感") == 2
+    assert automaton.suffix_prefix_length("词汇") == 2
+    assert automaton.suffix_prefix_length("无关") == 0
+
+
+def write_rules(path, keywords):
+    path.write_text("".join(f"blocked_term\t{keyword}\n" for keyword in keywords), encoding="utf-8")
+
+
+def test_readers_see_new_automaton_after_reload(tmp_path):
+    path = tmp_path / "keywords.txt"
+    write_rules(path, ["旧词", "alpha"])
+    validator = SecurityValidator(keyword_rules_path=str(path))
+    text = "旧词 alpha 新词 beta"
+    assert {m.pattern for m in validator.scan(text) if m.source == "keyword"} == {"旧词", "alpha"}
+
+    seen, errors = [], []
+    stop = threading.Event()
+
+    def reader():
+        try:
+            while not stop.is_set():
+                seen.append(frozenset(m.pattern for m in validator.scan(text) if m.source == "keyword"))
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=reader) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for i in range(20):
+        write_rules(path, ["新词", "beta"] if i % 2 == 0 else ["旧词", "alpha"])
+        validator.load_keyword_rules()
+    write_rules(path, ["新词", "beta"])
+    os.utime(path, ns=(0, 0))  # 确保修改时间与上次加载不同
+    assert validator.reload_keyword_rules_if_changed()
+    assert not validator.reload_keyword_rules_if_changed()
+    stop.set()
+    for t in threads:
+        t.join()
+
+    assert errors == []
+    # 每次扫描只看到某一版完整的规则，不会新旧混用
+    assert set(seen) <= {frozenset({"旧词", "alpha"}), frozenset({"新词", "beta"})}
+    assert {m.pattern for m in validator.scan(text) if m.source == "keyword"} == {"新词", "beta"}
+    assert validator.sanitize_output(text) == "旧词 alpha [REDACTED] [REDACTED]"
+
+
+class CountingValidator(SecurityValidator):
+    """统计 _keyword_automaton 的读取次数"""
+
+    reads = 0
+
+    @property
+    def _keyword_automaton(self):
+        self.reads += 1
+        return self.__dict__.get("_automaton")
+
+    @_keyword_automaton.setter
+    def _keyword_automaton(self, automaton):
+        self.__dict__["_automaton"] = automaton
+
+
+def test_stream_sanitizer_reads_automaton_once_per_chunk(tmp_path):
+    path = tmp_path / "keywords.txt"
+    write_rules(path, ["机密"])
+    validator = CountingValidator(keyword_rules_path=str(path))
+    stream = validator.stream_sanitizer()
+    validator.reads = 0
+    output = stream.feed("这是机") + stream.feed("密内容") + stream.flush()
+    assert output == "这是[REDACTED]内容"
+    assert validator.reads == 3
@@ -0,0 +1,160 @@
+import logging
+import math
+import random
+
+import pytest
+
+from technical_analysis import LoadBalancer
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr("technical_analysis.time.perf_counter", lambda: now[0])
+    return now
+
+
+def make_balancer(count, **kwargs):
+    balancer = LoadBalancer(**kwargs)
+    for i in range(count):
+        balancer.add_backend(f"b{i}")
+    return balancer
+
+
+def fail(balancer, backend_id, times):
+    for _ in range(times):
+        balancer.acquire(backend_id)
+        balancer.release(backend_id, latency=0.01, success=False)
+
+
+def test_failing_backend_is_ejected_and_reinstated_after_duration(clock, caplog):
+    balancer = make_balancer(2, max_failures=3, eject_duration=0.3)
+    fail(balancer, "b0", 2)
+    assert balancer.get_stats()["healthy"] == 2
+
+    with caplog.at_level(logging.WARNING):
+        fail(balancer, "b0", 1)
+    assert "摘除 0.3 秒" in caplog.text
+    assert {balancer.select_backend() for _ in range(10)} == {"b1"}
+    assert balancer.get_stats()["backends"]["b0"]["healthy"] is False
+
+    clock[0] += 0.29
+    assert {balancer.select_backend() for _ in range(10)} == {"b1"}
+    clock[0] += 0.02
+    assert {balancer.select_backend() for _ in range(10)} == {"b0", "b1"}
+
+    # 恢复后仍未成功过，再次摘除时长翻倍
+    caplog.clear()
+    with caplog.at_level(logging.WARNING):
+        fail(balancer, "b0", 3)
+    assert "摘除 0.6 秒" in caplog.text
+    clock[0] += 0.59
+    assert {balancer.select_backend() for _ in range(10)} == {"b1"}
+    clock[0] += 0.02
+    assert {balancer.select_backend() for _ in range(10)} == {"b0", "b1"}
+    assert balancer.get_stats()["healthy"] == 2
+
+
+def test_all_backends_ejected_returns_none(clock):
+    balancer = make_balancer(2, max_failures=1, eject_duration=1.0)
+    fail(balancer, "b0", 1)
+    fail(balancer, "b1", 1)
+    assert balancer.select_backend("least_connections") is None
+    with pytest.raises(RuntimeError):
+        with balancer.connection():
+            pass
+
+
+def test_least_connections_tracks_acquire_and_release():
+    rng = random.Random(3)
+    balancer = make_balancer(8, max_failures=1000)
+    held = []
+    for _ in range(5_000):
+        if held and rng.random() < 0.45:
+            balancer.release(held.pop(rng.randrange(len(held))))
+        else:
+            backend_id = balancer.select_backend("least_connections")
+            loads = balancer.current_loads
+            assert loads[backend_id] == min(loads.values())
+            balancer.acquire(backend_id)
+            held.append(backend_id)
+    assert sum(balancer.current_loads.values()) == len(held)
+
+    # 摘除与移除后，分桶中只剩健康后端
+    fail(balancer, "b0", 1000)
+    balancer.remove_backend("b1")
+    healthy = [f"b{i}" for i in range(2, 8)]
+    for _ in range(200):
+        backend_id = balancer.select_backend("least_connections")
+        assert backend_id in healthy
+        assert balancer.current_loads[backend_id] == min(balancer.current_loads[b] for b in healthy)
+        balancer.acquire(backend_id)
+
+
+def test_peak_ewma_prefers_low_latency_and_reacts_to_spikes(clock):
+    balancer = make_balancer(2, decay_time=10.0)
+    for backend_id, latency in (("b0", 0.2), ("b1", 0.02)):
+        balancer.acquire(backend_id)
+        balancer.release(backend_id, latency=latency)
+    assert {balancer.select_backend("peak_ewma") for _ in range(20)} == {"b1"}
+
+    # 一次慢响应立即抬升 peak-EWMA
+    clock[0] += 0.1
+    balancer.acquire("b1")
+    balancer.release("b1", latency=1.0)
+    assert {balancer.select_backend("peak_ewma") for _ in range(20)} == {"b0"}
+
+    # 活跃连接数计入成本
+    balancer.acquire("b1")
+    balancer.release("b1", latency=0.02)
+    clock[0] += 30.0
+    for _ in range(10):
+        balancer.acquire("b0")
+    assert balancer.select_backend("peak_ewma") == "b1"
+
+
+def test_backend_without_samples_is_probed_first():
+    balancer = make_balancer(1)
+    balancer.acquire("b0")
+    balancer.release("b0", latency=0.05)
+    balancer.add_backend("new")
+    assert balancer.select_backend("peak_ewma") == "new"
+
+
+def route_keys(balancer, keys):
+    return {key: balancer.select_backend("consistent_hash", key) for key in keys}
+
+
+@pytest.mark.parametrize("count", [3, 10])
+def test_adding_or_removing_a_backend_moves_about_one_nth_of_keys(count):
+    keys = [f"prompt-{i}" for i in range(20_000)]
+    balancer = make_balancer(count)
+    before = route_keys(balancer, keys)
+
+    balancer.add_backend("new")
+    after = route_keys(balancer, keys)
+    moved = [key for key in keys if before[key] != after[key]]
+    assert all(after[key] == "new" for key in moved)
+    assert abs(len(moved) / len(keys) - 1 / (count + 1)) < 0.5 / (count + 1)
+
+    balancer.remove_backend("b0")
+    removed = route_keys(balancer, keys)
+    moved = [key for key in keys if after[key] != removed[key]]
+    assert all(after[key] == "b0" for key in moved)
+    assert abs(len(moved) / len(keys) - 1 / (count + 1)) < 0.5 / (count + 1)
+
+
+def test_bounded_load_caps_each_backend():
+    balancer = make_balancer(4, load_factor=1.25)
+    rng = random.Random(11)
+    # 热点 key 占一半流量
+    keys = ["hot" if rng.random() < 0.5 else f"k{rng.randrange(1_000)}" for _ in range(2_000)]
+    for total, key in enumerate(keys, start=1):
+        balancer.acquire(balancer.select_backend("consistent_hash", key))
+        assert max(balancer.current_loads.values()) <= math.ceil(1.25 * total / 4)
+
+    # 不限负载时热点 key 全部落在同一个后端
+    unbounded = make_balancer(4, load_factor=None)
+    for _ in range(100):
+        unbounded.acquire(unbounded.select_backend("consistent_hash", "hot"))
+    assert max(unbounded.current_loads.values()) == 100
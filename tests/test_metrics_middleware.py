@@ -0,0 +1,49 @@
+from fastapi import APIRouter, FastAPI
+from fastapi.testclient import TestClient
+
+from app import metrics, products
+from technical_analysis import PerformanceMonitor
+
+
+def build_app(monitor):
+    app = FastAPI()
+    # 与 main.py 相同：中间件先注册，路由后挂载
+    app.add_middleware(metrics.MetricsMiddleware, monitor=monitor)
+    app.include_router(products.router)
+    app.include_router(metrics.router)
+    return app
+
+
+def test_labels_use_route_templates_of_routers_included_after_middleware():
+    monitor = PerformanceMonitor()
+    app = build_app(monitor)
+    client = TestClient(app)
+
+    assert client.get("/api/product/v1/42").status_code == 200
+    assert client.get("/docs").status_code == 200
+    assert client.get("/missing").status_code == 404
+
+    text = monitor.to_openmetrics()
+    assert 'route="/api/product/v1/{product_id}"' in text
+    assert 'route="/docs"' in text
+    assert 'route="__unmatched__"' in text
+    assert "/api/product/v1/42" not in text
+    # 未请求过的路由也已预注册
+    assert 'route="/api/product/v1/search"' in text
+
+
+def test_routes_added_after_first_request_are_templated():
+    monitor = PerformanceMonitor()
+    app = build_app(monitor)
+    client = TestClient(app)
+    client.get("/api/product/v1/1")
+
+    late = APIRouter(prefix="/late")
+
+    @late.get("/{item_id}")
+    async def late_item(item_id: int):
+        return {"id": item_id}
+
+    app.include_router(late)
+    assert client.get("/late/7").status_code == 200
+    assert 'route="/late/{item_id}"' in monitor.to_openmetrics()
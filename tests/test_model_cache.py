@@ -0,0 +1,372 @@
+import asyncio
+import random
+import sqlite3
+import threading
+import time
+from collections import Counter, OrderedDict
+
+import pytest
+
+from technical_analysis import DiskCacheTier, ModelCache
+
+
+@pytest.mark.parametrize("disk", [False, True])
+def test_single_flight_threads_compute_once_per_key(tmp_path, disk):
+    cache = ModelCache(disk_path=str(tmp_path / "cache.db") if disk else None)
+    calls = Counter()
+    calls_lock = threading.Lock()
+    barrier = threading.Barrier(16)
+    results = []
+
+    def compute(key):
+        with calls_lock:
+            calls[key] += 1
+        time.sleep(0.02)
+        return f"value-{key}"
+
+    def worker(i):
+        key = f"k{i % 4}"
+        barrier.wait()
+        results.append((key, cache.get_or_compute(key, lambda: compute(key))))
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(16)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    cache.close()
+
+    assert calls == {f"k{i}": 1 for i in range(4)}
+    assert all(value == f"value-{key}" for key, value in results)
+    assert len(results) == 16
+
+
+def test_single_flight_async_compute_once_per_key(tmp_path):
+    cache = ModelCache(disk_path=str(tmp_path / "cache.db"))
+    calls = Counter()
+
+    async def compute(key):
+        calls[key] += 1
+        await asyncio.sleep(0.02)
+        return f"value-{key}"
+
+    async def main():
+        return await asyncio.gather(*(
+            cache.aget_or_compute(f"k{i % 4}", lambda i=i: compute(f"k{i % 4}"))
+            for i in range(32)
+        ))
+
+    results = asyncio.run(main())
+    cache.close()
+
+    assert calls == {f"k{i}": 1 for i in range(4)}
+    assert results == [f"value-k{i % 4}" for i in range(32)]
+
+
+def test_single_flight_error_reaches_every_waiter_and_is_not_cached():
+    cache = ModelCache()
+    calls = 0
+    barrier = threading.Barrier(8)
+    errors = []
+
+    def failing():
+        nonlocal calls
+        calls += 1
+        time.sleep(0.05)
+        raise RuntimeError("boom")
+
+    def worker():
+        barrier.wait()
+        try:
+            cache.get_or_compute("key", failing)
+        except RuntimeError as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=worker) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert calls == 1
+    assert len(errors) == 8
+    assert cache.get("key") is None
+    assert cache.get_or_compute("key", lambda: "ok") == "ok"
+
+
+def test_async_error_reaches_every_waiter_and_is_not_cached():
+    cache = ModelCache()
+    calls = 0
+
+    async def failing():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.02)
+        raise RuntimeError("boom")
+
+    async def main():
+        return await asyncio.gather(
+            *(cache.aget_or_compute("key", failing) for _ in range(8)),
+            return_exceptions=True
+        )
+
+    results = asyncio.run(main())
+
+    assert calls == 1
+    assert all(isinstance(r, RuntimeError) for r in results)
+    assert cache.get("key") is None
+
+
+def test_disk_tier_write_behind_reads_own_writes_and_persists(tmp_path):
+    path = str(tmp_path / "cache.db")
+    cache = ModelCache(disk_path=path)
+    for i in range(50):
+        cache.set(f"k{i}", {"i": i})
+    # 内存层清空后仍能从待写队列或磁盘读到
+    cache.cache.clear()
+    cache.bytes_in_use = 0
+    assert cache.get("k7") == {"i": 7}
+    cache.close()
+
+    reopened = ModelCache(disk_path=path)
+    assert reopened.disk_tier.count() == 50
+    assert reopened.get("k42") == {"i": 42}
+    reopened.close()
+
+
+def test_get_stats_counts_disk_entries_outside_the_lock(tmp_path):
+    cache = ModelCache(disk_path=str(tmp_path / "cache.db"))
+    cache.set("a", 1)
+    count = cache.disk_tier.count
+    lock_free = []
+
+    def probe():
+        # 另一个线程能立即拿到锁，说明读取磁盘条目数时没有持有缓存锁
+        acquired = cache._lock.acquire(timeout=0)
+        if acquired:
+            cache._lock.release()
+        lock_free.append(acquired)
+
+    def counting():
+        t = threading.Thread(target=probe)
+        t.start()
+        t.join()
+        return count()
+
+    cache.disk_tier.count = counting
+    assert cache.get_stats()["disk_entries"] == 1
+    assert lock_free == [True]
+    cache.close()
+
+
+def test_semantic_lookup_embeds_query_outside_the_lock():
+    cache = ModelCache(semantic_threshold=0.9)
+    cache.set("什么是 Python", "一种编程语言")
+    embed = cache.embedder
+    lock_free = []
+
+    def probe():
+        acquired = cache._lock.acquire(timeout=0)
+        if acquired:
+            cache._lock.release()
+        lock_free.append(acquired)
+
+    def embedding(text):
+        t = threading.Thread(target=probe)
+        t.start()
+        t.join()
+        return embed(text)
+
+    cache.embedder = embedding
+    assert cache.get("什么是python?") == "一种编程语言"
+    assert cache.get("完全无关的问题") is None
+    assert lock_free == [True, True]
+    assert cache.semantic_hit_count == 1 and cache.semantic_miss_count == 1
+
+
+def test_oversized_value_is_not_written_to_disk(tmp_path):
+    path = str(tmp_path / "cache.db")
+    cache = ModelCache(max_bytes=200, disk_path=path)
+    cache.set("small", "ok")
+    cache.set("big", "x" * 1_000)
+    cache.set("small", "y" * 1_000)  # 覆盖为超大值时旧值也不能留在磁盘
+    assert cache.get("big") is None
+    assert cache.get("small") is None
+    cache.close()
+
+    reopened = ModelCache(disk_path=path)
+    assert reopened.disk_tier.count() == 0
+    reopened.close()
+
+
+def test_lru_get_refreshes_recency_and_evicts_oldest():
+    cache = ModelCache(max_size=3)
+    for key in "abc":
+        cache.set(key, key.upper())
+    assert cache.get("a") == "A"  # a 变为最近使用
+    cache.set("d", "D")
+    assert cache.get("b") is None
+    assert [cache.get(key) for key in "acd"] == ["A", "C", "D"]
+    assert cache.get_stats()["evictions"] == 1
+
+
+def test_lru_overwrite_updates_value_without_growing():
+    cache = ModelCache(max_size=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.set("a", 10)  # 覆盖后 a 成为最近使用，b 最旧
+    assert len(cache.cache) == 2
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert (cache.get("a"), cache.get("c")) == (10, 3)
+    assert cache.get_stats()["evictions"] == 1
+
+
+def test_lru_matches_reference_model():
+    rng = random.Random(1)
+    cache = ModelCache(max_size=16)
+    reference = OrderedDict()
+    for step in range(5_000):
+        key = f"k{rng.randrange(40)}"
+        if rng.random() < 0.5:
+            cache.set(key, step)
+            reference[key] = step
+            reference.move_to_end(key)
+            if len(reference) > 16:
+                reference.popitem(last=False)
+        else:
+            expected = reference.get(key)
+            if expected is not None:
+                reference.move_to_end(key)
+            assert cache.get(key) == expected
+    assert len(cache.cache) == len(reference)
+
+
+def disk_rows(path):
+    conn = sqlite3.connect(path)
+    try:
+        return dict(conn.execute("SELECT cache_key, hits FROM cache_entries").fetchall())
+    finally:
+        conn.close()
+
+
+def test_disk_tier_flush_commits_queued_writes_and_hits(tmp_path):
+    path = str(tmp_path / "cache.db")
+    tier = DiskCacheTier(path, flush_every=1_000)
+    for i in range(20):
+        tier.set(f"k{i}", i)
+    tier.delete("k3")
+    tier.record_hit("k5")
+    tier.record_hit("k5")
+    tier.flush()
+
+    rows = disk_rows(path)
+    assert sorted(rows) == sorted(f"k{i}" for i in range(20) if i != 3)
+    assert rows["k5"] == 2
+    assert tier.get("k7") == (7, None, 0.0)
+    assert tier.get("k3") is None
+    tier.close()
+
+
+def test_warm_start_loads_hottest_entries(tmp_path):
+    path = str(tmp_path / "cache.db")
+    cache = ModelCache(disk_path=path)
+    for i in range(10):
+        cache.set(f"k{i}", i)
+    for i, hits in ((2, 5), (7, 3), (4, 1)):
+        for _ in range(hits):
+            cache.disk_tier.record_hit(cache._hash_key(f"k{i}"))
+    cache.close()
+
+    warmed = ModelCache(disk_path=path, warm_start=2)
+    # 最热的键在 LRU 队尾
+    assert list(warmed.cache) == [warmed._hash_key("k7"), warmed._hash_key("k2")]
+    assert warmed.get("k2") == 2
+    assert warmed.get_stats()["disk_hits"] == 0
+    warmed.close()
+
+
+def test_expired_disk_rows_are_deleted(tmp_path, monkeypatch):
+    path = str(tmp_path / "cache.db")
+    cache = ModelCache(disk_path=path)
+    cache.set("short", "a", ttl=10)
+    cache.set("long", "b", ttl=1_000)
+    cache.cache.clear()
+    cache.bytes_in_use = 0
+
+    now = time.time()
+    monkeypatch.setattr("technical_analysis.time.time", lambda: now + 60)
+    assert [key for key, *_ in cache.disk_tier.hottest(10)] == [cache._hash_key("long")]
+    assert cache.get("short") is None
+    cache.disk_tier.flush()
+    assert list(disk_rows(path)) == [cache._hash_key("long")]
+    cache.close()
+
+
+def test_disk_hit_is_promoted_to_memory(tmp_path):
+    path = str(tmp_path / "cache.db")
+    cache = ModelCache(disk_path=path)
+    cache.set("key", {"v": 1})
+    cache.close()
+
+    reopened = ModelCache(disk_path=path)
+    assert not reopened.cache
+    assert reopened.get("key") == {"v": 1}
+    assert reopened._hash_key("key") in reopened.cache
+    assert reopened.get("key") == {"v": 1}
+    stats = reopened.get_stats()
+    assert (stats["disk_hits"], stats["hit_count"]) == (1, 2)
+    reopened.close()
+
+
+@pytest.mark.parametrize("disk", [False, True])
+def test_thousand_concurrent_thread_callers_compute_once(tmp_path, disk):
+    cache = ModelCache(disk_path=str(tmp_path / "cache.db") if disk else None)
+    calls = Counter()
+    calls_lock = threading.Lock()
+    started = threading.Event()
+    results = [None] * 1_000
+
+    def compute(key):
+        with calls_lock:
+            calls[key] += 1
+        started.wait()  # 所有线程都发起请求后计算才结束
+        return f"value-{key}"
+
+    def worker(i):
+        key = f"k{i % 10}"
+        results[i] = cache.get_or_compute(key, lambda: compute(key))
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(1_000)]
+    for t in threads:
+        t.start()
+    started.set()
+    for t in threads:
+        t.join()
+    cache.close()
+
+    assert calls == {f"k{i}": 1 for i in range(10)}
+    assert results == [f"value-k{i % 10}" for i in range(1_000)]
+
+
+def test_thousand_concurrent_async_callers_compute_once():
+    cache = ModelCache()
+    calls = Counter()
+
+    async def main():
+        release = asyncio.Event()
+
+        async def compute(key):
+            calls[key] += 1
+            await release.wait()
+            return f"value-{key}"
+
+        tasks = [asyncio.create_task(cache.aget_or_compute(f"k{i % 10}", lambda i=i: compute(f"k{i % 10}")))
+                 for i in range(1_000)]
+        await asyncio.sleep(0.05)
+        release.set()
+        return await asyncio.gather(*tasks)
+
+    results = asyncio.run(main())
+    assert calls == {f"k{i}": 1 for i in range(10)}
+    assert results == [f"value-k{i % 10}" for i in range(1_000)]
@@ -0,0 +1,71 @@
+import asyncio
+import threading
+
+import pytest
+
+from technical_analysis import PerformanceMonitor
+
+
+def test_span_modes_record_every_call():
+    monitor = PerformanceMonitor(flush_size=64)
+
+    @monitor.span("decorated")
+    def decorated():
+        pass
+
+    async def run_async():
+        for _ in range(100):
+            async with monitor.span("async"):
+                pass
+
+    for _ in range(100):
+        with monitor.span("sync"):
+            pass
+        decorated()
+    asyncio.run(run_async())
+
+    stats = monitor.get_stats()
+    assert {name: stats[name]["count"] for name in ("sync", "decorated", "async")} == \
+        {"sync": 100, "decorated": 100, "async": 100}
+
+
+def test_decorator_counts_errors_and_reraises():
+    monitor = PerformanceMonitor()
+
+    @monitor.span("failing")
+    def failing():
+        raise RuntimeError("boom")
+
+    with pytest.raises(RuntimeError):
+        failing()
+    assert monitor.get_stats()["failing"]["count"] == 1
+    assert monitor.counters["failing.errors"] == 1
+
+
+def test_concurrent_spans_keep_start_end_pairs():
+    """多线程并发追加时开始、结束时间戳不会错位（错位会产生负耗时或丢记录）"""
+    monitor = PerformanceMonitor(flush_size=128)
+
+    def worker():
+        for _ in range(5_000):
+            with monitor.span("threaded"):
+                pass
+
+    threads = [threading.Thread(target=worker) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    stats = monitor.get_stats()["threaded"]
+    assert stats["count"] == 20_000
+    assert stats["min_duration"] >= 0
+
+
+def test_span_parent_tracks_nesting():
+    monitor = PerformanceMonitor()
+    with monitor.span("outer") as outer:
+        with monitor.span("inner") as inner:
+            assert PerformanceMonitor.current_span() is inner
+            assert inner.parent is outer
+    assert PerformanceMonitor.current_span() is None
@@ -0,0 +1,134 @@
+import random
+import threading
+
+import pytest
+from fastapi import Depends, FastAPI, Header, HTTPException
+from fastapi.testclient import TestClient
+
+from app import permissions, products, users
+from technical_analysis import SecurityValidator
+
+
+def scan(validator, user_id, action, resource):
+    roles = validator.user_roles_db.get(user_id, validator.default_user_roles)
+    allowed = validator.permission_rules.get((action, resource), validator.default_required_roles)
+    return any(role in allowed for role in roles)
+
+
+def test_checks_match_nested_role_scan():
+    rng = random.Random(5)
+    roles = [f"role{i}" for i in range(80)]  # 超过 64 个角色，位图为大整数
+    validator = SecurityValidator()
+    validator.user_roles_db = {f"u{i}": rng.sample(roles, rng.randint(0, 4)) for i in range(500)}
+    validator.permission_rules = {(action, f"r{i}"): rng.sample(roles, rng.randint(1, 10))
+                                  for i in range(100) for action in ("read", "write")}
+    validator.default_required_roles = ["role0"]
+    validator.invalidate_permissions()
+
+    checks = [(f"u{rng.randrange(600)}", rng.choice(("read", "write", "delete")), f"r{rng.randrange(110)}")
+              for _ in range(5_000)]
+    expected = [scan(validator, *check) for check in checks]
+    assert [validator.check_permissions(*check) for check in checks] == expected
+    assert validator.check_permissions_batch(checks) == expected
+
+    required = [("read", "r1"), ("write", "r2")]
+    masks = validator.permission_masks(required)
+    for user_id in validator.user_roles_db:
+        assert validator.has_permissions(user_id, masks) == all(scan(validator, user_id, *p) for p in required)
+
+
+def test_cached_roles_refresh_after_invalidate_and_ttl(monkeypatch):
+    validator = SecurityValidator(role_cache_ttl=60.0)
+    assert not validator.check_permissions("user001", "delete", "system")
+
+    validator.user_roles_db["user001"] = ["admin"]
+    assert not validator.check_permissions("user001", "delete", "system")  # 仍为缓存值
+    validator.invalidate_permissions("user001")
+    assert validator.check_permissions("user001", "delete", "system")
+
+    validator.user_roles_db["user001"] = ["user"]
+    clock = validator._user_mask_expires
+    monkeypatch.setattr("technical_analysis.time.monotonic", lambda: clock + 1)
+    assert not validator.check_permissions("user001", "delete", "system")
+
+
+def test_role_cache_is_safe_under_concurrent_checks():
+    rng = random.Random(9)
+    roles = [f"role{i}" for i in range(10)]
+    # 容量很小且 TTL 为 0：每次检查都在清空、淘汰与写入缓存
+    validator = SecurityValidator(role_cache_ttl=0.0, role_cache_size=8)
+    validator.user_roles_db = {f"u{i}": rng.sample(roles, rng.randint(0, 3)) for i in range(200)}
+    validator.permission_rules = {("read", f"r{i}"): rng.sample(roles, 3) for i in range(20)}
+    validator.invalidate_permissions()
+    checks = [(f"u{rng.randrange(200)}", "read", f"r{rng.randrange(20)}") for _ in range(2_000)]
+    expected = [scan(validator, *check) for check in checks]
+
+    errors, mismatches = [], []
+    barrier = threading.Barrier(16)
+
+    def worker():
+        barrier.wait()
+        try:
+            for _ in range(5):
+                if [validator.check_permissions(*check) for check in checks] != expected:
+                    mismatches.append(1)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=worker) for _ in range(16)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert errors == [] and mismatches == []
+    assert len(validator._user_mask_cache) <= 8
+
+
+TOKENS = {"token-admin": "admin", "token-user": "user001"}
+
+
+def current_user(authorization: str = Header(...)) -> str:
+    user_id = TOKENS.get(authorization)
+    if user_id is None:
+        raise HTTPException(status_code=401, detail="未认证")
+    return user_id
+
+
+@pytest.fixture
+def client():
+    app = FastAPI()
+    app.include_router(users.router)
+    app.include_router(products.router)
+
+    @app.delete("/system/{item_id}", dependencies=[
+        Depends(permissions.require_permissions(("delete", "system"), current_user=current_user))])
+    async def delete_item(item_id: int):
+        return {"deleted": item_id}
+
+    return TestClient(app)
+
+
+def test_identity_comes_from_authentication_not_headers(client):
+    assert client.delete("/system/1").status_code == 422
+    assert client.delete("/system/1", headers={"authorization": "forged"}).status_code == 401
+    # 客户端自报的用户 ID 不起作用
+    assert client.delete("/system/1", headers={"authorization": "token-user",
+                                               "x-user-id": "admin"}).status_code == 403
+    assert client.delete("/system/1", headers={"authorization": "token-admin"}).status_code == 200
+
+
+def test_existing_routes_stay_ungated(client):
+    assert client.get("/api/product/v1/7").status_code == 200
+    assert client.get("/api/users/v1/1", headers={"token": "fake-super-secret-token"}).status_code == 200
+
+
+def test_invalidate_user_applies_role_changes(client):
+    headers = {"authorization": "token-user"}
+    assert client.delete("/system/1", headers=headers).status_code == 403
+    permissions.validator.user_roles_db["user001"] = ["admin"]
+    try:
+        permissions.invalidate_user("user001")
+        assert client.delete("/system/1", headers=headers).status_code == 200
+    finally:
+        permissions.validator.user_roles_db["user001"] = ["user"]
+        permissions.invalidate_user("user001")
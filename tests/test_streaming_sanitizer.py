@@ -0,0 +1,71 @@
+import random
+
+import pytest
+
+from technical_analysis import SecurityValidator, StreamingSanitizer
+
+SPECIALS = ["4111-1111-1111-1111", "4111 1111 1111 1111", "4111111111111111", "123-45-6789",
+            "13800138000", "alice.smith+tag@mail.example.com", "x@y.io", "<script>alert(1)</script>",
+            "<SCRIPT src=a></script>", "内部机密", "confidential-internal", "身份证号",
+            "x13800138000", "1380013800", "138001380001", "2024-01-01", "bob@host", "<scr", "<script"]
+FILLER = ["hello", "世界", " ", ", ", "。", "a", "1", "-", "@", ".", "\n"]
+
+
+@pytest.fixture(scope="module")
+def validator(tmp_path_factory):
+    path = tmp_path_factory.mktemp("rules") / "keywords.txt"
+    path.write_text("blocked_term\t内部机密\nblocked_term\tconfidential-internal\nsensitive_data\t身份证号\n",
+                    encoding="utf-8")
+    return SecurityValidator(keyword_rules_path=str(path))
+
+
+@pytest.fixture(scope="module")
+def dense_text():
+    rng = random.Random(17)
+    return " ".join(rng.choice(SPECIALS) + rng.choice(FILLER) for _ in range(40))
+
+
+def stream(validator, chunks):
+    sanitizer = StreamingSanitizer(validator)
+    parts = [sanitizer.feed(chunk) for chunk in chunks]
+    parts.append(sanitizer.flush())
+    return "".join(parts)
+
+
+def test_two_chunks_split_at_every_offset(validator, dense_text):
+    expected = validator.sanitize_output(dense_text)
+    mismatches = [cut for cut in range(len(dense_text) + 1)
+                  if stream(validator, [dense_text[:cut], dense_text[cut:]]) != expected]
+    assert mismatches == []
+
+
+def test_char_by_char(validator, dense_text):
+    assert stream(validator, list(dense_text)) == validator.sanitize_output(dense_text)
+
+
+def test_random_text_random_chunks(validator):
+    rng = random.Random(19)
+    mismatches = 0
+    for _ in range(500):
+        # 待定命中超过 max_hold（默认 512）时不保证一致，随机文本控制在此长度内
+        text = "".join(rng.choice(SPECIALS + FILLER) for _ in range(rng.randint(1, 60)))[:512]
+        chunks, position = [], 0
+        while position < len(text):
+            size = rng.randint(1, 8)
+            chunks.append(text[position:position + size])
+            position += size
+        mismatches += stream(validator, chunks) != validator.sanitize_output(text)
+    assert mismatches == 0
+
+
+def test_held_back_tail_is_bounded(validator):
+    sanitizer = StreamingSanitizer(validator, max_hold=16)
+    output = "".join(sanitizer.feed(ch) for ch in "<script" + "x" * 100)
+    assert sanitizer.pending <= 16
+    assert sanitizer.max_held <= 16
+    assert output + sanitizer.flush() == "<script" + "x" * 100
+
+
+def test_rejects_non_positive_max_hold(validator):
+    with pytest.raises(ValueError):
+        StreamingSanitizer(validator, max_hold=0)
@@ -0,0 +1,50 @@
+import numpy as np
+import pytest
+
+from technical_analysis import VectorMemoryStore
+
+
+def make_vectors(count, dim=16, seed=0):
+    return np.random.default_rng(seed).standard_normal((count, dim), dtype=np.float32)
+
+
+def test_refuses_to_overwrite_existing_vector_file(tmp_path):
+    path = tmp_path / "vectors.f32"
+    path.write_bytes(b"\x00" * 64)
+    with pytest.raises(ValueError):
+        VectorMemoryStore(dim=16, path=str(path))
+    assert path.read_bytes() == b"\x00" * 64
+
+
+def test_memmap_store_matches_in_memory_store(tmp_path):
+    path = tmp_path / "vectors.f32"
+    path.touch()  # 空文件可以使用
+    vectors = make_vectors(3_000)
+    ids = [f"v{i}" for i in range(len(vectors))]
+    stores = [VectorMemoryStore(dim=16, train_threshold=1_000, capacity=256),
+              VectorMemoryStore(dim=16, path=str(path), train_threshold=1_000, capacity=256)]
+    for store in stores:
+        store.add_batch(ids[:2_000], vectors[:2_000])
+        for item_id, vector in zip(ids[2_000:], vectors[2_000:]):
+            store.add(item_id, vector)
+        for item_id in ids[::3]:
+            store.remove(item_id)
+
+    memory, mapped = stores
+    assert isinstance(mapped._matrix, np.memmap)
+    assert len(memory) == len(mapped) == 2_000
+    for query in make_vectors(20, seed=1):
+        assert memory.search(query, 5) == mapped.search(query, 5)
+        assert [item for item, _ in memory.search(query, 5, exact=True)] == \
+            [item for item, _ in mapped.search(query, 5, exact=True)]
+
+
+def test_exact_search_ignores_removed_items():
+    store = VectorMemoryStore(dim=16)
+    vectors = make_vectors(10)
+    for i, vector in enumerate(vectors):
+        store.add(i, vector)
+    store.remove(3)
+    assert 3 not in store
+    assert all(item != 3 for item, _ in store.search(vectors[3], k=9))
+    assert store.search(vectors[4], k=1)[0][0] == 4
@@ -2,17 +2,27 @@ import uvicorn
 from fastapi import FastAPI
 from fastapi.responses import StreamingResponse
 from app.ai_writer import AIWriter
+from technical_analysis import SecurityValidator
 import json
 
 
 app = FastAPI()
 
 ai_writer = AIWriter()
+validator = SecurityValidator()
 
 
 async def stream_response(query: str):
+    # 每个流一个清理器：跨块的卡号/邮箱/手机号只推迟很短的尾部，不会被拆开漏过
+    sanitizer = validator.stream_sanitizer()
     async for chunk in ai_writer.run_stream(query):
-        json_data = json.dumps({"text":chunk},ensure_ascii=False)
+        text = sanitizer.feed(chunk)
+        if text:
+            json_data = json.dumps({"text":text},ensure_ascii=False)
+            yield f"data: {json_data}\n\n"
+    text = sanitizer.flush()
+    if text:
+        json_data = json.dumps({"text":text},ensure_ascii=False)
         yield f"data: {json_data}\n\n"
 
 